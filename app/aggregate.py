@@ -0,0 +1,149 @@
+from collections import Counter
+from labels import get_classifier
+import logging
+
+logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(format=logFormatter, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def new_team_tallies():
+    return {
+        "weight": Counter(),
+        "timespent": Counter(),
+        "timeestimate": Counter(),
+        "user": Counter(),
+        "status": Counter(),
+        "category": Counter(),
+        "priority": Counter(),
+        "severity": Counter(),
+        "milestone": Counter(),
+        "epic": Counter(),
+        "participant": Counter()
+    }
+
+
+def aggregate_issues(issues,CONFIG_MAP):
+    """Walk the iteration issues once and fill everything build_metrics needs for the iteration and every team.
+    Gives the same results as iteration_summarize_status, iteration_based_metrics, the iteration half of
+    get_issue_counts and run_retro2 for each team.
+
+    Args:
+        issues (list): Issues in the iteration
+        CONFIG_MAP (dict): Configuration
+
+    Returns:
+        dict:
+            summary (tuple): Same as iteration_summarize_status
+            iteration (tuple): Same as iteration_based_metrics
+            counts (Counter): Iteration issue count by team
+            teams (dict): team -> same as team_based_metrics on that team's issues
+    """
+    teams = CONFIG_MAP['teams']
+    team_label = CONFIG_MAP['team_label']
+    classify = get_classifier(CONFIG_MAP).classify
+    done_label = CONFIG_MAP['done_status_label']
+
+    status_tally = Counter()
+    priority_tally = Counter()
+    severity_tally = Counter()
+
+    overall_weight = 0
+    label_weight = Counter()
+    timesestimate_label = Counter()
+    timespent_label = Counter()
+    overall_timespent = 0
+    overall_timeestimate = 0
+    epic_tally = Counter()
+    milestone_tally = Counter()
+
+    counts = Counter()
+    team_tallies = {team: new_team_tallies() for team in teams}
+
+    for issue in issues:
+        labels = issue['labels']
+        labelset = set(labels)
+
+        weight = issue['weight'] or 0
+        time_stats = issue['time_stats']
+        timespent = (time_stats['total_time_spent'] or 0)//3600
+        timeestimate = (time_stats['time_estimate'] or 0)//3600
+
+        overall_weight += weight
+        overall_timespent += timespent
+        overall_timeestimate += timeestimate
+
+        milestone = None
+        if issue['milestone']:
+            milestone = issue['milestone']['title'] or "No Milestone"
+            milestone_tally[milestone] += 1
+        epic = None
+        if issue['epic']:
+            epic = issue['epic']['title'] or "No Epic"
+            epic_tally[epic] += 1
+
+        members = []
+        if team_label in labelset:
+            members = [team_tallies[team] for team in teams if CONFIG_MAP[team] in labelset]
+
+        opened = issue['state'] == "opened"
+        for tallies in members:
+            for users in issue['assignees']:
+                user = users['name']
+                #If isssue is closed don't count the weight or the estimate
+                tallies['weight'][user] += weight if opened else 0
+                tallies['timespent'][user] += timespent
+                tallies['timeestimate'][user] += timeestimate if opened else 0
+                tallies['user'][user] += 1
+            if milestone:
+                tallies['milestone'][milestone] += 1
+            if epic:
+                tallies['epic'][epic] += 1
+
+        for label in labels:
+            label_class = classify(label)
+            if label_class.team:
+                counts[label_class.team] += 1
+
+            category = label_class.category
+            if category is None:
+                continue
+            summary = label_class.summary
+
+            if summary in ("dev", "qa"):
+                status_tally[label] += 1
+            elif summary == "priority":
+                priority_tally[label] += 1
+            elif summary == "severity":
+                severity_tally[label] += 1
+
+            if category == "dev":
+                label_weight[label] += weight
+                timesestimate_label[label] += timeestimate
+                timespent_label[label] += timespent
+
+            for tallies in members:
+                if category in ("dev", "qa"):
+                    tallies['status'][label] += 1
+                    if category == "dev" and label == done_label:
+                        for participants in issue['assignees']:
+                            tallies['participant'][participants['name']] += 1
+                elif category == "issue":
+                    tallies['category'][label] += 1
+                elif category == "priority":
+                    tallies['priority'][label] += 1
+                elif category == "severity":
+                    tallies['severity'][label] += 1
+
+    results = {
+        "summary": (status_tally,priority_tally,severity_tally),
+        "iteration": (overall_weight,label_weight,overall_timeestimate,overall_timespent,timesestimate_label,timespent_label,epic_tally,milestone_tally),
+        "counts": counts,
+        "teams": {}
+    }
+    for team in teams:
+        tallies = team_tallies[team]
+        results['teams'][team] = (
+            tallies['weight'],tallies['timespent'],tallies['timeestimate'],tallies['user'],tallies['status'],
+            tallies['category'],tallies['priority'],tallies['severity'],tallies['milestone'],tallies['epic'],tallies['participant']
+        )
+    return results
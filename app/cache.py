@@ -0,0 +1,137 @@
+import threading
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class LRUCache:
+    """Size bounded least recently used cache that keeps hit/miss counts"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Look up a key, marking it as recently used
+
+        Args:
+            key (hashable): Key to look up
+            default (optional): Returned when the key is missing
+
+        Returns:
+            Cached value or default
+        """
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries over maxsize
+
+        Args:
+            key (hashable): Key to store under
+            value: Value to store
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def record(self, hit):
+        """Count a lookup as a hit or a miss
+
+        Args:
+            hit (bool): Whether the lookup was served from the cache
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def resize(self, maxsize):
+        """Change the size cap, evicting if needed
+
+        Args:
+            maxsize (int): New size cap
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def items(self):
+        """Snapshot of the cached entries, least recently used first"""
+        with self._lock:
+            return list(self._data.items())
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SingleFlight:
+    """Shares the result of a call between every caller asking for the same key while a scope is open.
+    A caller arriving while the call is running waits for it, one arriving after gets its result.
+    Results are dropped when the last scope closes, failed calls are never kept.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def scope(self):
+        """Share results until the block exits"""
+        with self._lock:
+            self.active += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.active -= 1
+                if not self.active:
+                    self._calls.clear()
+
+    def do(self, key, func):
+        """Run func once per key within the scope, outside a scope it always runs
+
+        Args:
+            key (hashable): What makes two calls the same
+            func (function): Call to make, takes no arguments
+
+        Returns:
+            Whatever func returned for the first caller
+        """
+        with self._lock:
+            if not self.active:
+                call = None
+                owner = True
+            elif key in self._calls:
+                call = self._calls[key]
+                owner = False
+                self.shared += 1
+            else:
+                call = self._calls[key] = Future()
+                owner = True
+        if not owner:
+            return call.result()
+        if call is None:
+            return func()
+        try:
+            result = func()
+        except BaseException as e:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.set_exception(e)
+            raise
+        call.set_result(result)
+        return result
@@ -0,0 +1,339 @@
+import threading
+import time
+import logging
+import exposition
+
+logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(format=logFormatter, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Held while a snapshot is being applied to the registry and rendered.  Scrapes are served from
+# the rendered bytes, so they never see a half applied refresh.
+snapshot_lock = exposition.snapshot_lock
+
+REFRESH_STATE = {
+    "last_success": None,
+    "last_duration": None,
+    "started": time.time(),
+    # Seconds from start until /metrics first had a snapshot to serve
+    "ready_after": None
+}
+# Set to cut the wait before the next refresh short, e.g. after a config reload
+refresh_requested = threading.Event()
+
+
+class MetricSnapshot:
+    """Metric values gathered during a refresh, kept off to the side until they are applied"""
+
+    def __init__(self):
+        self.gauges = {}
+        self.infos = {}
+        self.created = time.time()
+
+    def set(self, gauge, labels, value):
+        """Record a value for a gauge
+
+        Args:
+            gauge (Gauge): Gauge the value belongs to
+            labels (tuple): Label values in the order the gauge declares them
+            value (float): Value to set
+        """
+        self.gauges.setdefault(gauge, {})[tuple(labels)] = value
+
+    def info(self, info, labels, value):
+        """Record the value of an Info metric
+
+        Args:
+            info (Info): Info metric the value belongs to
+            labels (tuple): Label values in the order the Info declares them
+            value (dict): Info labels
+        """
+        self.infos.setdefault(info, {})[tuple(labels)] = value
+
+    def discard(self, gauges, prefixes):
+        """Drop the series starting with some label values, e.g. (group, iteration) for the iteration
+        gauges, whose first two labels are the group and the iteration
+
+        Args:
+            gauges (list): Gauges to drop series from
+            prefixes (list): Tuples of leading label values to drop
+        """
+        for gauge in gauges:
+            series = self.gauges.get(gauge, {})
+            for labels in [labels for labels in series if any(labels[:len(prefix)] == prefix for prefix in prefixes)]:
+                del series[labels]
+
+    def only(self, prefixes):
+        """Copy holding only the series starting with some label values, e.g. (group,) for the series
+        of one config
+
+        Args:
+            prefixes (list): Tuples of leading label values to keep
+
+        Returns:
+            MetricSnapshot: The series kept
+        """
+        kept = MetricSnapshot()
+        for (metrics, target) in ((self.gauges, kept.gauges), (self.infos, kept.infos)):
+            for (metric, series) in metrics.items():
+                target[metric] = {labels: value for (labels, value) in series.items() if any(labels[:len(prefix)] == prefix for prefix in prefixes)}
+        return kept
+
+    def add(self, other, sign=1):
+        """Add another snapshot's gauge values to this one's, or subtract them with sign -1.  For the
+        series that are sums over issues, see main.issue_series
+
+        Args:
+            other (MetricSnapshot): Snapshot to add
+            sign (int, optional): 1 to add, -1 to subtract
+        """
+        for gauge, series in other.gauges.items():
+            mine = self.gauges.setdefault(gauge, {})
+            for (labels, value) in series.items():
+                mine[labels] = mine.get(labels, 0) + sign * value
+
+    def merge(self, other):
+        """Copy every value recorded in another snapshot into this one
+
+        Args:
+            other (MetricSnapshot): Snapshot to copy from
+        """
+        for gauge, series in other.gauges.items():
+            self.gauges.setdefault(gauge, {}).update(series)
+        for info, series in other.infos.items():
+            self.infos.setdefault(info, {}).update(series)
+
+
+class MetricState:
+    """What has been written to each metric, so applying a snapshot only touches the series that changed"""
+
+    def __init__(self):
+        self.values = {}
+        self.children = {}
+
+    def apply(self, snapshot, gauges, infos):
+        """Bring the metrics in line with a snapshot.  Called with snapshot_lock held
+
+        Args:
+            snapshot (MetricSnapshot): Values collected during the refresh
+            gauges (list): Every Gauge owned by the snapshot
+            infos (list): Every Info owned by the snapshot
+
+        Returns:
+            tuple: (series set, series removed)
+        """
+        changed = 0
+        removed = 0
+        for gauge in gauges:
+            (set_count, removed_count) = self.update(gauge, snapshot.gauges.get(gauge, {}), lambda child, value: child.set(value))
+            changed += set_count
+            removed += removed_count
+        for info in infos:
+            (set_count, removed_count) = self.update(info, snapshot.infos.get(info, {}), lambda child, value: child.info(value))
+            changed += set_count
+            removed += removed_count
+        return (changed, removed)
+
+    def snapshot(self, gauges, infos):
+        """Copy of what is currently applied
+
+        Args:
+            gauges (list): Every Gauge owned by the snapshot
+            infos (list): Every Info owned by the snapshot
+
+        Returns:
+            MetricSnapshot: Snapshot holding the applied values
+        """
+        snapshot = MetricSnapshot()
+        for gauge in gauges:
+            snapshot.gauges[gauge] = dict(self.values.get(gauge, {}))
+        for info in infos:
+            snapshot.infos[info] = dict(self.values.get(info, {}))
+        return snapshot
+
+    def add(self, delta):
+        """Add a delta to the applied gauges, touching only the series in it.  Called with snapshot_lock held
+
+        Args:
+            delta (MetricSnapshot): Amount to add to each series, see MetricSnapshot.add
+
+        Returns:
+            int: Series set
+        """
+        changed = 0
+        for gauge, series in delta.gauges.items():
+            values = self.values.setdefault(gauge, {})
+            children = self.children.setdefault(gauge, {})
+            for (labels, amount) in series.items():
+                if labels in values and not amount:
+                    continue
+                value = values.get(labels, 0) + amount
+                if labels not in children:
+                    children[labels] = gauge.labels(*labels)
+                children[labels].set(value)
+                values[labels] = value
+                changed += 1
+        return changed
+
+    def update(self, metric, new, write):
+        """Diff one metric's series against what it holds now
+
+        Args:
+            metric (Gauge or Info): Metric to update
+            new (dict): Label values tuple -> value
+            write (function): Writes a value to a child of the metric
+
+        Returns:
+            tuple: (series set, series removed)
+        """
+        changed = 0
+        removed = 0
+        old = self.values.get(metric, {})
+        children = self.children.setdefault(metric, {})
+        for labels in old.keys() - new.keys():
+            metric.remove(*labels)
+            del children[labels]
+            removed += 1
+        for labels, value in new.items():
+            if labels in old and old[labels] == value:
+                continue
+            if labels not in children:
+                children[labels] = metric.labels(*labels)
+            write(children[labels], value)
+            changed += 1
+        # A copy, add changes it in place
+        self.values[metric] = dict(new)
+        return (changed, removed)
+
+
+APPLIED = MetricState()
+
+
+def apply_snapshot(snapshot, gauges, infos):
+    """Swap a finished snapshot into the registry, updating only what changed
+
+    Args:
+        snapshot (MetricSnapshot): Values collected during the refresh
+        gauges (list): Every Gauge owned by the snapshot
+        infos (list): Every Info owned by the snapshot
+
+    Returns:
+        tuple: (series set, series removed)
+    """
+    with snapshot_lock:
+        (changed, removed) = APPLIED.apply(snapshot, gauges, infos)
+        # Nothing moved, keep the rendered bytes and with them the ETag
+        if changed or removed:
+            exposition.render()
+    if REFRESH_STATE['ready_after'] is None:
+        REFRESH_STATE['ready_after'] = time.time() - REFRESH_STATE['started']
+        logger.info("Ready to serve metrics {:.2f}s after start".format(REFRESH_STATE['ready_after']))
+    return (changed, removed)
+
+
+def applied_snapshot(gauges, infos):
+    """Copy of the snapshot currently applied
+
+    Args:
+        gauges (list): Every Gauge owned by the snapshot
+        infos (list): Every Info owned by the snapshot
+
+    Returns:
+        MetricSnapshot: The applied values
+    """
+    with snapshot_lock:
+        return APPLIED.snapshot(gauges, infos)
+
+
+def apply_delta(delta):
+    """Add a delta to the applied series without a full refresh, e.g. one issue's change.  The gauges are
+    rendered again on the next scrape, so a burst of changes is rendered once
+
+    Args:
+        delta (MetricSnapshot): Amount to add to each series, see MetricSnapshot.add
+
+    Returns:
+        int: Series set
+    """
+    with snapshot_lock:
+        changed = APPLIED.add(delta)
+        if changed:
+            exposition.mark_stale()
+    return changed
+
+
+def snapshot_age():
+    """Seconds since the last successful refresh, NaN until the first one finishes"""
+    if REFRESH_STATE['last_success'] is None:
+        return float('nan')
+    return time.time() - REFRESH_STATE['last_success']
+
+
+def refresh_once(collect, gauges, infos, on_refresh=None):
+    """Run a single collection and apply it
+
+    Args:
+        collect (function): Builds and returns a MetricSnapshot
+        gauges (list): Every Gauge owned by the snapshot
+        infos (list): Every Info owned by the snapshot
+        on_refresh (function, optional): Called with the snapshot once it has been applied
+    """
+    start = time.time()
+    snapshot = collect()
+    (changed, removed) = apply_snapshot(snapshot, gauges, infos)
+    REFRESH_STATE['last_duration'] = time.time() - start
+    REFRESH_STATE['last_success'] = time.time()
+    logger.info("Refresh finished in {:.2f}s, {} series set, {} removed".format(REFRESH_STATE['last_duration'], changed, removed))
+    if on_refresh:
+        try:
+            on_refresh(snapshot)
+        except Exception:
+            logger.exception("Post refresh hook failed")
+
+
+def refresh_loop(collect, gauges, infos, interval, on_refresh=None):
+    """Keep the snapshot fresh.  A failed refresh leaves the previous snapshot in place
+
+    Args:
+        collect (function): Builds and returns a MetricSnapshot
+        gauges (list): Every Gauge owned by the snapshot
+        infos (list): Every Info owned by the snapshot
+        interval (function): Seconds between the start of two refreshes, read after each refresh
+        on_refresh (function, optional): Called with each snapshot once it has been applied
+    """
+    while True:
+        start = time.time()
+        refresh_requested.clear()
+        try:
+            refresh_once(collect, gauges, infos, on_refresh)
+        except Exception:
+            logger.exception("Refresh failed, keeping previous snapshot")
+        refresh_requested.wait(max(0, interval() - (time.time() - start)))
+
+
+def request_refresh():
+    """Start the next refresh now instead of at the end of the interval"""
+    refresh_requested.set()
+
+
+def start_refresh_thread(collect, gauges, infos, interval, on_refresh=None):
+    """Start the background collector
+
+    Args:
+        collect (function): Builds and returns a MetricSnapshot
+        gauges (list): Every Gauge owned by the snapshot
+        infos (list): Every Info owned by the snapshot
+        interval (function): Seconds between the start of two refreshes, read after each refresh
+        on_refresh (function, optional): Called with each snapshot once it has been applied
+
+    Returns:
+        Thread: The collector thread
+    """
+    thread = threading.Thread(
+        target=refresh_loop,
+        args=(collect, gauges, infos, interval, on_refresh),
+        name="gitlabkpis-collector",
+        daemon=True
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+import gitlab_client
+from scheduler import PRIORITY_HIGH
+
+logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(format=logFormatter, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CONFIG_STATE = {
+    "source": None,
+    "started": time.time(),
+    "ready_after": None,
+    "reloads": 0,
+    "unchanged": 0,
+    "failures": 0
+}
+
+
+def config_files(project):
+    """Config file names in CONFIG_FILENAME (comma separated)"""
+    return [filename.strip() for filename in (project['CONFIG_FILE'] or "").split(",") if filename.strip()]
+
+
+def parse_configs(texts, project):
+    """Configs in the text of each config file.  A file can hold one config or a list of them.
+
+    Args:
+        texts (list): Contents of each config file
+        project (dict): Settings from the environment, added to every config
+
+    Returns:
+        list: Configurations
+    """
+    configs = []
+    for text in texts:
+        loaded = json.loads(text)
+        for config in (loaded if isinstance(loaded, list) else [loaded]):
+            config.update(project)
+            configs.append(config)
+    return configs
+
+
+def digest(texts):
+    return hashlib.sha1("\0".join(texts).encode()).hexdigest()
+
+
+class ConfigSource:
+    """The configs the collector runs with.  Startup takes them from the cached copy of the last remote
+    config or from a local file, so it never waits on GitLab.  The remote config is fetched in the
+    background, conditionally, and swapped in whenever it changes.
+    """
+
+    def __init__(self, project, local_path=None, cache_path=None):
+        self.project = project
+        self.local_path = local_path
+        self.cache_path = cache_path
+        self.configs = []
+        self.ready = threading.Event()
+        # file name -> (ETag, text) of the last remote fetch
+        self._files = {}
+        self._digest = None
+        self._fetch_lock = threading.Lock()
+
+    @property
+    def remote(self):
+        """Whether there is a remote config to fetch"""
+        return bool(self.project['GITLAB_PROJECT_ID'] and config_files(self.project))
+
+    def load_initial(self):
+        """Take the cached remote config, or failing that the local file.  Reads local files only
+
+        Returns:
+            bool: True when a config was loaded
+        """
+        if self.cache_path and os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path) as f:
+                    files = {filename: tuple(entry) for (filename, entry) in json.load(f).items()}
+                texts = [files[filename][1] for filename in config_files(self.project)]
+                self.swap(parse_configs(texts, self.project), "cache", digest(texts))
+                self._files = files
+                return True
+            except Exception:
+                logger.exception("Could not read the cached config {}".format(self.cache_path))
+        if self.local_path and os.path.exists(self.local_path):
+            try:
+                with open(self.local_path) as f:
+                    text = f.read()
+                self.swap(parse_configs([text], self.project), "local", None)
+                return True
+            except Exception:
+                logger.exception("Could not read the local config {}".format(self.local_path))
+        return False
+
+    def fetch(self):
+        """Fetch the remote config files, sending If-None-Match with the ETag of the last copy
+
+        Returns:
+            bool: True when the configs changed and were swapped in
+        """
+        with self._fetch_lock:
+            return self._fetch()
+
+    def _fetch(self):
+        files = {}
+        for filename in config_files(self.project):
+            (etag, text) = self._files.get(filename, (None, None))
+            headers = dict(self.project['GITLAB_HEADERS'])
+            if etag and text is not None:
+                headers['If-None-Match'] = etag
+            response = gitlab_client.get(
+                self.project['GITLAB_URL'] + "projects/{}/repository/files/{}/raw?ref={}".format(self.project['GITLAB_PROJECT_ID'],filename,self.project['BRANCH_NAME']),
+                headers=headers,
+                priority=PRIORITY_HIGH
+            )
+            if response.status_code == 304:
+                files[filename] = (etag, text)
+                continue
+            response.raise_for_status()
+            files[filename] = (response.headers.get('ETag'), response.text)
+        texts = [text for (etag, text) in files.values()]
+        # GitLab may not send an ETag, an unchanged body is still not a reload
+        if digest(texts) == self._digest:
+            self._files = files
+            CONFIG_STATE['unchanged'] += 1
+            return False
+        configs = parse_configs(texts, self.project)
+        self._files = files
+        self.swap(configs, "remote", digest(texts))
+        self.save_cache()
+        return True
+
+    def swap(self, configs, source, text_digest):
+        if not configs:
+            raise ValueError("No configs in the {} config".format(source))
+        self.configs = configs
+        self._digest = text_digest
+        CONFIG_STATE['source'] = source
+        if self.ready.is_set():
+            CONFIG_STATE['reloads'] += 1
+        else:
+            CONFIG_STATE['ready_after'] = time.time() - CONFIG_STATE['started']
+            self.ready.set()
+        logger.info("Using {} config(s) from the {} config".format(len(configs), source))
+
+    def save_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            directory = os.path.dirname(self.cache_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.cache_path + ".tmp", "w") as f:
+                json.dump(self._files, f)
+            os.replace(self.cache_path + ".tmp", self.cache_path)
+        except OSError:
+            logger.exception("Could not write the cached config {}".format(self.cache_path))
+
+    def watch(self, interval, on_change):
+        """Fetch the remote config straight away and then every interval() seconds, in the background.
+        Until a config is in hand failed fetches are retried sooner.
+
+        Args:
+            interval (function): Seconds between two fetches, read before each wait
+            on_change (function): Called with the new configs after every swap
+
+        Returns:
+            Thread: The watcher thread
+        """
+        def run():
+            while True:
+                try:
+                    if self.fetch():
+                        on_change(self.configs)
+                except Exception:
+                    CONFIG_STATE['failures'] += 1
+                    logger.exception("Config fetch failed, keeping the current config")
+                time.sleep(interval() if self.ready.is_set() else min(interval(), 10))
+
+        thread = threading.Thread(target=run, name="gitlabkpis-config", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,160 @@
+import zlib
+import hashlib
+import threading
+from prometheus_client import CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily
+from starlette.responses import Response
+
+# The collected KPI gauges live here instead of the default registry.  They only change when a
+# snapshot is applied, so they are rendered once per refresh and every scrape reuses the bytes.
+# The default registry keeps the exporter's own metrics, which are small and rendered per scrape.
+SNAPSHOT_REGISTRY = CollectorRegistry(auto_describe=True)
+
+GZIP_LEVEL = 6
+
+# Held while the snapshot gauges change and while they are rendered
+snapshot_lock = threading.Lock()
+# Set when a few series changed since the last render, see mark_stale
+_stale = False
+
+
+class RenderedSnapshot:
+    """Exposition text of a snapshot, plain and gzip compressed"""
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = 'W/"{}"'.format(hashlib.sha1(body).hexdigest()[:20])
+        # wbits 31 writes a gzip header and trailer.  Flushing to a byte boundary leaves a compressor
+        # that can be copied on each scrape to append the live metrics to the same gzip stream.
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        self.gzip_body = self._compressor.compress(body) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def gzip(self, tail):
+        """Gzip body of the snapshot followed by tail, only tail is compressed
+
+        Args:
+            tail (bytes): Exposition text rendered for this scrape
+
+        Returns:
+            bytes: Complete gzip stream
+        """
+        compressor = self._compressor.copy()
+        return self.gzip_body + compressor.compress(tail) + compressor.flush()
+
+
+RENDERED = RenderedSnapshot(b"")
+
+
+class CounterCollector:
+    """Exposes counts kept as plain numbers by the collector modules as Prometheus counters, read on
+    every scrape.  The counts only go up, so rate() and increase() work on them across restarts.
+
+    Args:
+        counters (list): (name, documentation, function returning the count), the name without _total
+    """
+
+    def __init__(self, counters):
+        self.counters = counters
+
+    def describe(self):
+        return [CounterMetricFamily(name, documentation) for (name, documentation, count) in self.counters]
+
+    def collect(self):
+        for (name, documentation, count) in self.counters:
+            family = CounterMetricFamily(name, documentation)
+            family.add_metric([], count())
+            yield family
+
+
+def render(registry=SNAPSHOT_REGISTRY):
+    """Render the snapshot gauges, called with snapshot_lock held whenever a snapshot is applied"""
+    global RENDERED, _stale
+    RENDERED = RenderedSnapshot(generate_latest(registry))
+    _stale = False
+
+
+def mark_stale():
+    """A few series changed, e.g. from a webhook.  Called with snapshot_lock held, the gauges are rendered
+    on the next scrape instead of after every change"""
+    global _stale
+    _stale = True
+
+
+def current():
+    """The rendered snapshot, rendered again first when series changed since the last render"""
+    if _stale:
+        with snapshot_lock:
+            if _stale:
+                render()
+    return RENDERED
+
+
+def accepts_gzip(header):
+    """Whether an Accept-Encoding header allows gzip
+
+    Args:
+        header (str): Accept-Encoding value
+
+    Returns:
+        bool: True when gzip (or *) is listed without q=0.  A q that does not parse is not a refusal.
+    """
+    for coding in header.split(","):
+        (name, *params) = [part.strip() for part in coding.split(";")]
+        if name.lower() not in ("gzip", "*"):
+            continue
+        for param in params:
+            (key, _, value) = param.partition("=")
+            if key.strip().lower() != "q":
+                continue
+            try:
+                if float(value.strip()) == 0:
+                    return False
+            except ValueError:
+                pass
+        return True
+    return False
+
+
+def etag_matches(header, etag):
+    """Weak comparison of an If-None-Match header against our ETag"""
+    if header.strip() == "*":
+        return True
+    ours = etag[2:]
+    return any(candidate.strip().replace("W/", "", 1) == ours for candidate in header.split(","))
+
+
+def metrics_response(request):
+    """Serve the cached snapshot plus the live exporter metrics
+
+    The ETag only tracks the snapshot.  Exporter metrics such as gitlabkpis_snapshot_age_seconds move
+    between scrapes, so two responses with the same (weak) ETag can differ in those series.
+
+    Args:
+        request (Request): Scrape request
+
+    Returns:
+        Response: Exposition text, gzip compressed when the scraper accepts it
+    """
+    return snapshot_response(request, current(), lambda: generate_latest(REGISTRY))
+
+
+def snapshot_response(request, rendered, render_live):
+    """Response for a scrape, see metrics_response
+
+    Args:
+        request (Request): Scrape request
+        rendered (RenderedSnapshot): Snapshot to serve
+        render_live (function): Returns the exposition text of the live metrics, not called for a 304
+
+    Returns:
+        Response: Exposition text, gzip compressed when the scraper accepts it
+    """
+    headers = {"ETag": rendered.etag, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match", ""), rendered.etag):
+        return Response(status_code=304, headers=headers)
+    live = render_live()
+    headers["Content-Type"] = CONTENT_TYPE_LATEST
+    if accepts_gzip(request.headers.get("accept-encoding", "")):
+        headers["Content-Encoding"] = "gzip"
+        return Response(rendered.gzip(live), status_code=200, headers=headers)
+    return Response(rendered.body + live, status_code=200, headers=headers)
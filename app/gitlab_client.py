@@ -0,0 +1,169 @@
+import threading
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from scheduler import RequestScheduler, PRIORITY_NORMAL
+from cache import SingleFlight
+from instrumentation import observe_response
+
+logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(format=logFormatter, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Defaults, overridden by the http_* keys in the config once it has been loaded
+CLIENT_SETTINGS = {
+    "http_pool_size": 10,
+    "http_timeout": 30,
+    "http_retries": 3,
+    "http_backoff": 0.5,
+    "http_max_in_flight": 8,
+    "rate_limit_low_water": 0.1
+}
+
+_session = None
+_session_lock = threading.Lock()
+# One budget for every request in flight, whichever collector section sent it
+scheduler = RequestScheduler(CLIENT_SETTINGS['http_max_in_flight'], CLIENT_SETTINGS['rate_limit_low_water'])
+# Identical requests made while a refresh is running, e.g. by two configs sharing a group, go out once.
+# Only call sites passing shared=True take part, their responses are held until the refresh ends.
+SHARED = SingleFlight()
+
+
+def build_session(settings):
+    """Build a keep-alive session with retry/backoff on 5xx.  429s are left to the scheduler
+
+    Args:
+        settings (dict): Client settings
+
+    Returns:
+        Session: Pooled session
+    """
+    retry = Retry(
+        total=int(settings['http_retries']),
+        backoff_factor=float(settings['http_backoff']),
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["GET", "HEAD"],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=int(settings['http_pool_size']),
+        pool_maxsize=int(settings['http_pool_size']),
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip"})
+    return session
+
+
+def configure(CONFIG_MAP):
+    """Rebuild the shared session from the http_* settings in the config
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+    """
+    global _session, scheduler
+    settings = {key: CONFIG_MAP.get(key, value) for (key, value) in CLIENT_SETTINGS.items()}
+    # A config reload that leaves the http_* settings alone keeps the pool and the requests in flight
+    if settings == CLIENT_SETTINGS and _session is not None:
+        return
+    CLIENT_SETTINGS.update(settings)
+    with _session_lock:
+        old = _session
+        _session = build_session(CLIENT_SETTINGS)
+        scheduler = RequestScheduler(CLIENT_SETTINGS['http_max_in_flight'], CLIENT_SETTINGS['rate_limit_low_water'])
+    if old is not None:
+        old.close()
+    logger.info("GitLab client pool size {} timeout {}s max in flight {}".format(
+        CLIENT_SETTINGS['http_pool_size'], CLIENT_SETTINGS['http_timeout'], CLIENT_SETTINGS['http_max_in_flight']))
+
+
+def get_session():
+    """Shared session, created on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = build_session(CLIENT_SETTINGS)
+        return _session
+
+
+def get(url, headers=None, priority=PRIORITY_NORMAL, shared=False, **kwargs):
+    """GET against the GitLab API through the shared pool.  Waits for a slot from the scheduler and
+    retries 429s once the scheduler's pause is over.
+
+    Args:
+        url (str): Full url to request
+        headers (dict, optional): Request headers, normally CONFIG_MAP['GITLAB_HEADERS']
+        priority (int, optional): Scheduler priority, cheap calls everything else waits on go first
+        shared (bool, optional): Inside a SHARED scope, answer an identical request (same url and headers)
+            already made or in flight with the same response.  For the few small calls every config
+            makes (iterations, releases, backlog counts, project lists), not per issue or per project ones
+
+    Returns:
+        Response: The response
+    """
+    if kwargs or not shared:
+        return send(url, headers, priority, **kwargs)
+    key = ("GET", url, tuple(sorted((headers or {}).items())))
+    return SHARED.do(key, lambda: send(url, headers, priority))
+
+
+def post(url, json, headers=None, priority=PRIORITY_NORMAL):
+    """POST a JSON body through the shared pool and scheduler, e.g. a GraphQL query.  Never shared
+    between callers, see get
+
+    Args:
+        url (str): Full url to request
+        json (dict): Request body
+        headers (dict, optional): Request headers, normally CONFIG_MAP['GITLAB_HEADERS']
+        priority (int, optional): Scheduler priority
+
+    Returns:
+        Response: The response
+    """
+    return send(url, headers, priority, method="POST", json=json)
+
+
+def send(url, headers=None, priority=PRIORITY_NORMAL, method="GET", **kwargs):
+    """Make the request, see get"""
+    kwargs.setdefault('timeout', float(CLIENT_SETTINGS['http_timeout']))
+    kwargs.setdefault('verify', True)
+    session = get_session()
+    request_scheduler = scheduler
+    for attempt in range(int(CLIENT_SETTINGS['http_retries']) + 1):
+        request_scheduler.acquire(priority)
+        response = None
+        start = time.time()
+        try:
+            response = session.request(method, url, headers=headers, **kwargs)
+        finally:
+            observe_response(url, response, time.time() - start, streamed=kwargs.get('stream', False))
+            request_scheduler.release(response)
+        if response.status_code != 429:
+            break
+        response.close()
+    return response
+
+
+def connection_stats():
+    """Connection reuse across the pool
+
+    Returns:
+        dict: requests made, connections opened and requests that reused a connection
+    """
+    stats = {"requests": 0, "connections": 0, "reused": 0}
+    session = get_session()
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+    stats['reused'] = max(0, stats['requests'] - stats['connections'])
+    return stats
@@ -0,0 +1,234 @@
+import re
+import logging
+import gitlab_client
+from issues import compact_issue
+from scheduler import PRIORITY_HIGH, PRIORITY_NORMAL
+from instrumentation import ISSUE_PAGES
+
+logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(format=logFormatter, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Only the fields the aggregators read.  Label changes come back as activity notes on each issue,
+# so eng_done_status needs no resource_label_events call per issue.
+ISSUES_QUERY = """
+query GroupIssues($fullPath: ID!, $labels: [String!], $iteration: String, $state: IssuableState,
+                  $updatedAfter: Time, $first: Int!, $after: String, $withEvents: Boolean!) {
+  group(fullPath: $fullPath) {
+    issues(labelName: $labels, iterationTitle: $iteration, state: $state, updatedAfter: $updatedAfter,
+           includeSubgroups: true, first: $first, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        id iid projectId state updatedAt weight timeEstimate totalTimeSpent
+        labels(first: 100) { nodes { id title } }
+        assignees(first: 100) { nodes { name username } }
+        milestone { title }
+        epic { title }
+        iteration { title }
+        notes(filter: ONLY_ACTIVITY, first: 100) @include(if: $withEvents) {
+          pageInfo { hasNextPage }
+          nodes { body author { name } systemNoteMetadata { action } }
+        }
+      }
+    }
+  }
+}
+"""
+
+LABELS_QUERY = """
+query GroupLabels($fullPath: ID!, $after: String) {
+  group(fullPath: $fullPath) {
+    labels(includeAncestorGroups: true, includeDescendantGroups: true, first: 100, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes { id title }
+    }
+  }
+}
+"""
+
+# Words of a label system note that matter: the action, then label references as ~123, ~"two words" or ~word
+_LABEL_NOTE_TOKEN = re.compile(r'\b(added|removed)\b|~(?:(\d+)\b|"([^"]+)"|([^\s~"]+))')
+
+# parent_group id -> full path
+_GROUP_PATHS = {}
+
+
+def graphql_url(CONFIG_MAP):
+    """GraphQL endpoint next to the REST API, or graphql_url from the config"""
+    if CONFIG_MAP.get('graphql_url'):
+        return CONFIG_MAP['graphql_url']
+    return CONFIG_MAP['GITLAB_URL'].rstrip("/").rsplit("/v4", 1)[0] + "/graphql"
+
+
+def query(CONFIG_MAP, document, variables, priority=PRIORITY_NORMAL):
+    """Run a GraphQL query
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        document (str): Query
+        variables (dict): Query variables
+        priority (int, optional): Scheduler priority
+
+    Returns:
+        dict: The data of the response
+    """
+    response = gitlab_client.post(
+        graphql_url(CONFIG_MAP),
+        {"query": document, "variables": variables},
+        headers=CONFIG_MAP['GITLAB_HEADERS'],
+        priority=priority
+    )
+    response.raise_for_status()
+    body = response.json()
+    if body.get('errors'):
+        raise ValueError("GraphQL query failed: {}".format("; ".join(error.get('message', "") for error in body['errors'])))
+    return body['data']
+
+
+def gid_number(gid):
+    """gid://gitlab/Issue/123 -> 123"""
+    return int(str(gid).rsplit("/", 1)[-1])
+
+
+def group_path(CONFIG_MAP):
+    """Full path of parent_group, which GraphQL looks groups up by.  parent_group_path in the config
+    skips the lookup, a parent_group that is already a path is used as is.
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+
+    Returns:
+        str: Group full path
+    """
+    if CONFIG_MAP.get('parent_group_path'):
+        return CONFIG_MAP['parent_group_path']
+    group = str(CONFIG_MAP['parent_group'])
+    if not group.isdigit():
+        return group
+    if group not in _GROUP_PATHS:
+        _GROUP_PATHS[group] = gitlab_client.get(
+            CONFIG_MAP['GITLAB_URL'] + "groups/{}?with_projects=false".format(group),
+            headers=CONFIG_MAP['GITLAB_HEADERS'],
+            priority=PRIORITY_HIGH
+        ).json()['full_path']
+    return _GROUP_PATHS[group]
+
+
+def get_label_titles(CONFIG_MAP, path):
+    """Label id -> title for the group, its ancestors and subgroups.  Label notes reference labels by id.
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        path (str): Group full path
+
+    Returns:
+        dict: Label titles by id
+    """
+    titles = {}
+    after = None
+    while True:
+        labels = query(CONFIG_MAP, LABELS_QUERY, {"fullPath": path, "after": after}, PRIORITY_HIGH)['group']['labels']
+        for label in labels['nodes']:
+            titles[gid_number(label['id'])] = label['title']
+        if not labels['pageInfo']['hasNextPage']:
+            return titles
+        after = labels['pageInfo']['endCursor']
+
+
+def label_events_from_notes(notes, titles):
+    """Turn label activity notes ("added ~1 ~2 labels and removed ~3 label") into the label events
+    get_label_events returns.  References to labels that no longer exist are skipped, like events
+    whose label was deleted.
+
+    Args:
+        notes (list): Note nodes
+        titles (dict): Label titles by id
+
+    Returns:
+        list: (label name, action, user name) for every event that still has a label
+    """
+    events = []
+    for note in notes:
+        if (note.get('systemNoteMetadata') or {}).get('action') != "label":
+            continue
+        user = (note.get('author') or {}).get('name')
+        action = None
+        for (verb, label_id, quoted, word) in _LABEL_NOTE_TOKEN.findall(note['body']):
+            if verb:
+                action = "add" if verb == "added" else "remove"
+                continue
+            title = titles.get(int(label_id)) if label_id else quoted or word
+            if action is not None and title is not None:
+                events.append((title, action, user))
+    return events
+
+
+def issue_from_node(CONFIG_MAP, node):
+    """Compact Issue from an issue node, shaped like the REST issue it stands for"""
+    return compact_issue({
+        "id": gid_number(node['id']),
+        "iid": int(node['iid']),
+        "state": node['state'],
+        "updated_at": node['updatedAt'],
+        "labels": [label['title'] for label in node['labels']['nodes']],
+        "assignees": node['assignees']['nodes'],
+        "weight": node.get('weight'),
+        "time_stats": {"time_estimate": node.get('timeEstimate'), "total_time_spent": node.get('totalTimeSpent')},
+        "milestone": node.get('milestone'),
+        "epic": node.get('epic'),
+        # REST url of the issue, label events are fetched from it when the notes did not fit
+        "_links": {"self": "{}projects/{}/issues/{}".format(CONFIG_MAP['GITLAB_URL'], node['projectId'], node['iid'])}
+    })
+
+
+def locate_issues(CONFIG_MAP, filter_labels, iteration, label_event_cache, updated_after=None):
+    """GraphQL counterpart of retro.locate_issues.  Issues come in cursor paginated batches of
+    graphql_page_size (defaults to 50) with their label history, which is put in the label event
+    cache so run_team_issue_activity makes no call per issue.  Issues with more activity than one
+    batch holds are left to get_label_events.
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        filter_labels (str): Label to filter by
+        iteration (str): Iteration name, or "backlog"
+        label_event_cache (LRUCache): retro.LABEL_EVENT_CACHE
+        updated_after (str, optional): Only issues updated after this ISO 8601 time
+
+    Returns:
+        list: Issues, as compact Issues
+    """
+    path = group_path(CONFIG_MAP)
+    with_events = CONFIG_MAP.get('issue_activity') == 1
+    variables = {
+        "fullPath": path,
+        "labels": [label for label in filter_labels.split(",") if label],
+        "iteration": None if iteration == "backlog" else iteration,
+        "state": "opened" if iteration == "backlog" else None,
+        "updatedAfter": updated_after,
+        "first": int(CONFIG_MAP.get('graphql_page_size', 50)),
+        "after": None,
+        "withEvents": with_events
+    }
+    titles = {}
+    if with_events:
+        key = ("graphql_labels", graphql_url(CONFIG_MAP), path)
+        titles = dict(gitlab_client.SHARED.do(key, lambda: get_label_titles(CONFIG_MAP, path)))
+
+    gl_issues = []
+    while True:
+        issues = query(CONFIG_MAP, ISSUES_QUERY, variables)['group']['issues']
+        ISSUE_PAGES.inc()
+        for node in issues['nodes']:
+            issue = issue_from_node(CONFIG_MAP, node)
+            gl_issues.append(issue)
+            notes = node.get('notes')
+            if notes is None or notes['pageInfo']['hasNextPage']:
+                continue
+            # Labels still on the issue cover project labels the group query does not return
+            titles.update((gid_number(label['id']), label['title']) for label in node['labels']['nodes'])
+            label_event_cache.put(issue['id'], (issue['updated_at'], label_events_from_notes(notes['nodes'], titles)))
+        if not issues['pageInfo']['hasNextPage']:
+            break
+        variables['after'] = issues['pageInfo']['endCursor']
+    logger.info("GraphQL: {} issues for {} ({})".format(len(gl_issues), filter_labels, iteration))
+    return gl_issues
@@ -0,0 +1,65 @@
+import logging
+import gitlab_client
+from collector import MetricSnapshot
+from retro import get_closed_iterations
+from store import snapshot_to_dict, snapshot_from_dict
+
+logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(format=logFormatter, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (parent_group, team_label, iteration id) -> {"title", "due_date", "series"}.  A closed iteration does not
+# change, so its series are worked out once and reused on every refresh after that.
+ITERATION_HISTORY = {}
+HISTORY_STATS = {
+    "computed": 0,
+    "reused": 0
+}
+
+
+def history_key(CONFIG_MAP, iteration):
+    return (str(CONFIG_MAP['parent_group']), CONFIG_MAP['team_label'], iteration['id'])
+
+
+
+def collect_history(CONFIG_MAP, compute, gauges, infos):
+    """Iteration series for the last iteration_history (defaults to 0, off) closed iterations.  Only
+    iterations not seen before are computed, the rest come from ITERATION_HISTORY.
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        compute (function): compute(CONFIG_MAP, iteration title, snapshot) adds an iteration's series
+        gauges (list): Every Gauge the series can belong to
+        infos (list): Every Info the series can belong to
+
+    Returns:
+        MetricSnapshot: Series of the closed iterations
+    """
+    snapshot = MetricSnapshot()
+    count = int(CONFIG_MAP.get('iteration_history', 0))
+    if count <= 0:
+        return snapshot
+    wanted = set()
+    for iteration in get_closed_iterations(CONFIG_MAP, count):
+        key = history_key(CONFIG_MAP, iteration)
+        wanted.add(key)
+        entry = ITERATION_HISTORY.get(key)
+        if entry is None:
+            entry = gitlab_client.SHARED.do(("history",) + key, lambda: compute_entry(CONFIG_MAP, iteration, compute))
+            ITERATION_HISTORY[key] = entry
+        else:
+            HISTORY_STATS['reused'] += 1
+        snapshot_from_dict(entry['series'], snapshot, gauges, infos)
+    # Iterations that dropped out of the window are not needed again
+    config = (str(CONFIG_MAP['parent_group']), CONFIG_MAP['team_label'])
+    for key in [key for key in list(ITERATION_HISTORY) if key[:2] == config and key not in wanted]:
+        del ITERATION_HISTORY[key]
+    return snapshot
+
+
+def compute_entry(CONFIG_MAP, iteration, compute):
+    partial = MetricSnapshot()
+    compute(CONFIG_MAP, iteration['title'], partial)
+    HISTORY_STATS['computed'] += 1
+    logger.info("Computed history for {} ({})".format(iteration['title'], CONFIG_MAP['team_label']))
+    return {"title": iteration['title'], "due_date": iteration['due_date'], "series": snapshot_to_dict(partial)}
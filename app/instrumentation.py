@@ -0,0 +1,109 @@
+import re
+import functools
+from prometheus_client import Counter, Histogram
+
+STAGE_SECONDS = Histogram(
+    "gitlabkpis_collector_stage_seconds", "Time spent in each collector stage", ["stage"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+REQUEST_SECONDS = Histogram("gitlabkpis_gitlab_request_seconds", "GitLab API request latency", ["endpoint"])
+RESPONSES = Counter("gitlabkpis_gitlab_responses", "GitLab API responses by status code", ["endpoint", "status"])
+RESPONSE_BYTES = Counter("gitlabkpis_gitlab_response_bytes", "Bytes of response bodies received from the GitLab API, as sent (compressed)", ["endpoint"])
+ISSUE_PAGES = Counter("gitlabkpis_gitlab_issue_pages", "Pages of issues fetched from GitLab")
+
+# Path segments that are ids or names rather than part of the endpoint
+_ID_SEGMENTS = [
+    (re.compile(r"/(groups|projects)/[^/]+"), r"/\1/:id"),
+    (re.compile(r"/files/[^/]+"), "/files/:file"),
+    (re.compile(r"/\d+(?=/|$)"), "/:id")
+]
+
+
+def endpoint_name(url):
+    """Turn a request url into a low cardinality endpoint label
+
+    Args:
+        url (str): Full request url
+
+    Returns:
+        str: Endpoint, e.g. projects/:id/issues/:id/resource_label_events
+    """
+    path = url.split("?", 1)[0]
+    if "/api/v4" in path:
+        path = path.split("/api/v4", 1)[1]
+    elif "/api/" in path:
+        # api/graphql
+        path = path.split("/api/", 1)[1]
+    for (pattern, replacement) in _ID_SEGMENTS:
+        path = pattern.sub(replacement, path)
+    return path.strip("/")
+
+
+def observe_response(url, response, seconds, streamed=False):
+    """Record latency, status and size of a GitLab response
+
+    Args:
+        url (str): Request url
+        response (Response): Response, None when the request raised
+        seconds (float): Request duration
+        streamed (bool, optional): The body is read later, whoever reads it calls observe_bytes
+    """
+    endpoint = endpoint_name(url)
+    REQUEST_SECONDS.labels(endpoint).observe(seconds)
+    if response is None:
+        RESPONSES.labels(endpoint, "error").inc()
+        return
+    RESPONSES.labels(endpoint, str(response.status_code)).inc()
+    if not streamed:
+        observe_bytes(url, response, len(response.content))
+
+
+def wire_size(response, decoded):
+    """Bytes of a response body read off the socket so far, before gzip is undone
+
+    Args:
+        response (Response): Response
+        decoded (int): Decoded body size, used when the response says nothing else
+
+    Returns:
+        int: Body size as sent
+    """
+    try:
+        return int(response.raw.tell())
+    except (AttributeError, TypeError, ValueError):
+        pass
+    length = response.headers.get("Content-Length", "")
+    return int(length) if length.isdigit() else decoded
+
+
+def observe_bytes(url, response, decoded):
+    """Record the size of a response body as it came over the wire
+
+    Args:
+        url (str): Request url
+        response (Response): Response whose body was read
+        decoded (int): Decoded body size
+    """
+    RESPONSE_BYTES.labels(endpoint_name(url)).inc(wire_size(response, decoded))
+
+
+def stage(name):
+    """Context manager timing a collector stage"""
+    return STAGE_SECONDS.labels(name).time()
+
+
+def timed_stage(name, func):
+    """Wrap a function so every call is timed as a collector stage
+
+    Args:
+        name (str): Stage name
+        func (function): Function to wrap
+
+    Returns:
+        function: Wrapped function
+    """
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        with stage(name):
+            return func(*args, **kwargs)
+    return timed
@@ -0,0 +1,182 @@
+import sys
+import json
+import codecs
+import weakref
+import threading
+from instrumentation import observe_bytes
+
+# Bytes read from the socket at a time when streaming a page
+CHUNK_SIZE = 64 * 1024
+
+class SharedValue(dict):
+    """A dict the shared table only holds weakly, never modified once built"""
+
+
+# Values shared between issues.  Users, milestones and epics repeat across thousands of issues, each
+# distinct one is kept once and every issue points at it.  An entry goes away with the last issue using it.
+_shared = weakref.WeakValueDictionary()
+_shared_lock = threading.Lock()
+
+
+def shared(key, build):
+    """The one copy of a repeated value
+
+    Args:
+        key (hashable): What identifies the value
+        build (function): Builds the value (a SharedValue) when no issue holds one for the key
+
+    Returns:
+        The shared value
+    """
+    value = _shared.get(key)
+    if value is None:
+        with _shared_lock:
+            value = _shared.get(key)
+            if value is None:
+                value = _shared[key] = build()
+    return value
+
+
+def shared_title(kind, title):
+    return shared((kind, title), lambda: SharedValue(title=sys.intern(title)))
+
+
+def shared_user(name):
+    return shared(("user", name), lambda: SharedValue(name=sys.intern(name)))
+
+
+class Issue:
+    """The parts of a GitLab issue the collector reads.  Supports issue['labels'] style access, so it can
+    stand in for the decoded JSON everywhere issues are used.
+    """
+
+    __slots__ = ("id", "iid", "state", "updated_at", "labels", "assignees", "weight", "time_estimate", "total_time_spent", "milestone", "epic", "link")
+
+    FIELDS = ("id", "iid", "state", "updated_at", "labels", "assignees", "weight", "time_stats", "milestone", "epic", "_links")
+
+    def __getitem__(self, key):
+        if key == "_links":
+            return {"self": self.link}
+        if key == "time_stats":
+            return {"time_estimate": self.time_estimate, "total_time_spent": self.total_time_spent}
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.FIELDS
+
+    def to_dict(self):
+        """Plain dict in the shape of the GitLab JSON, for storing"""
+        issue = {key: self[key] for key in self.FIELDS}
+        issue['labels'] = list(self.labels)
+        issue['assignees'] = list(self.assignees)
+        return issue
+
+    def __repr__(self):
+        return "Issue(id={}, labels={})".format(self.id, list(self.labels))
+
+
+def compact_issue(raw):
+    """Project a decoded GitLab issue down to an Issue, sharing repeated values
+
+    Args:
+        raw (dict): Issue as returned by the REST API (or an Issue)
+
+    Returns:
+        Issue: Compact issue
+    """
+    issue = Issue()
+    issue.id = raw['id']
+    issue.iid = raw.get('iid')
+    issue.state = sys.intern(raw['state'])
+    issue.updated_at = raw.get('updated_at')
+    issue.labels = tuple(sys.intern(label) for label in raw['labels'])
+    issue.assignees = tuple(shared_user(user['name']) for user in raw.get('assignees') or [])
+    issue.weight = raw.get('weight')
+    time_stats = raw.get('time_stats') or {}
+    # Close to unique per issue, kept as plain values
+    issue.time_estimate = time_stats.get('time_estimate')
+    issue.total_time_spent = time_stats.get('total_time_spent')
+    issue.milestone = shared_title("milestone", raw['milestone']['title']) if raw.get('milestone') else None
+    issue.epic = shared_title("epic", raw['epic']['title']) if raw.get('epic') else None
+    issue.link = (raw.get('_links') or {}).get('self')
+    return issue
+
+
+def compact_issues(raw_issues):
+    """compact_issue over a page of issues"""
+    return [compact_issue(raw) for raw in raw_issues]
+
+
+def iter_json_array(chunks):
+    """Decode the elements of a JSON array of objects as the text arrives, one element at a time
+
+    Args:
+        chunks (iterable): Pieces of the JSON text
+
+    Yields:
+        Each element of the array
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    started = False
+    for chunk in chunks:
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array, got {!r}".format(buffer[pos:pos + 80]))
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                (element, end) = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The element is cut off, wait for the next chunk
+                break
+            yield element
+            pos = end
+    raise ValueError("JSON array ended early")
+
+
+def stream_issues(response):
+    """Read a page of issues straight off the socket, turning each one into a compact Issue as soon as it
+    is decoded.  Only one decoded issue is alive at a time instead of the whole page.
+
+    Args:
+        response (Response): Response requested with stream=True
+
+    Yields:
+        Issue: Issues on the page
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+    size = [0]
+
+    def chunks():
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            size[0] += len(chunk)
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+
+    try:
+        for raw in iter_json_array(chunks()):
+            yield compact_issue(raw)
+    finally:
+        response.close()
+        observe_bytes(response.url, response, size[0])
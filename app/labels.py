@@ -0,0 +1,128 @@
+import re
+from collections import namedtuple, defaultdict
+
+# Order of the label checks in team_based_metrics, the first prefix that matches wins
+LABEL_CHECKS = [
+    ("dev", 'dev_label_prefix'),
+    ("qa", 'qa_label_prefix'),
+    ("issue", 'issue_status_prefix'),
+    ("priority", 'priority_label_prefix'),
+    ("severity", 'severity_label_prefix')
+]
+
+# category: first match of the full check order (team_based_metrics)
+# summary: first match skipping the issue prefix (iteration_summarize_status)
+# team: team name for a team label, taken from the label the way get_issue_counts does
+# backlog: label is the backlog label
+LabelClass = namedtuple("LabelClass", ["category", "summary", "team", "backlog"])
+
+_classifiers = {}
+
+
+class LabelClassifier:
+    """Classifies label strings against the prefixes in the config.  Prefixes are compiled once
+    and every distinct label is only matched the first time it is seen."""
+
+    def __init__(self, CONFIG_MAP):
+        self.checks = [(category, re.compile(CONFIG_MAP[prefix])) for (category, prefix) in LABEL_CHECKS]
+        self.team_labels = set(CONFIG_MAP[team] for team in CONFIG_MAP['teams'])
+        self.backlog_label = CONFIG_MAP['backlog_label']
+        self._classes = {}
+
+    def classify(self, label):
+        """Classify a label
+
+        Args:
+            label (str): Label to classify
+
+        Returns:
+            LabelClass: Categories for the label
+        """
+        found = self._classes.get(label)
+        if found is None:
+            matches = [category for (category, pattern) in self.checks if pattern.search(label)]
+            found = LabelClass(
+                matches[0] if matches else None,
+                next((match for match in matches if match != "issue"), None),
+                label.split(' ')[0].lower() if label in self.team_labels else None,
+                label == self.backlog_label
+            )
+            self._classes[label] = found
+        return found
+
+
+def classifier_key(CONFIG_MAP):
+    return (
+        tuple(CONFIG_MAP[prefix] for (category, prefix) in LABEL_CHECKS),
+        tuple(CONFIG_MAP[team] for team in CONFIG_MAP['teams']),
+        CONFIG_MAP['backlog_label']
+    )
+
+
+def get_classifier(CONFIG_MAP):
+    """Classifier for a config, built the first time the config is seen
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+
+    Returns:
+        LabelClassifier: Classifier for the config's prefixes
+    """
+    key = classifier_key(CONFIG_MAP)
+    classifier = _classifiers.get(key)
+    if classifier is None:
+        classifier = LabelClassifier(CONFIG_MAP)
+        _classifiers[key] = classifier
+    return classifier
+
+
+def reset_classifiers():
+    """Forget every classifier, after a config reload the next lookup builds them from the new config"""
+    _classifiers.clear()
+
+
+class LabelIndex:
+    """Inverted index from label to the issues carrying it, built once per refresh so
+    team and backlog views become set intersections instead of list scans."""
+
+    def __init__(self, issues):
+        self.issues = issues
+        self.by_label = defaultdict(set)
+        for (position, issue) in enumerate(issues):
+            for label in issue['labels']:
+                self.by_label[label].add(position)
+
+    def positions(self, labels, not_labels=()):
+        """Positions of the issues that carry every label in labels and none in not_labels
+
+        Args:
+            labels (list): Labels that must all be present
+            not_labels (list, optional): Labels that must not be present
+
+        Returns:
+            set: Matching issue positions
+        """
+        if not labels:
+            matched = set(range(len(self.issues)))
+        else:
+            sets = sorted((self.by_label.get(label, set()) for label in labels), key=len)
+            matched = set(sets[0]).intersection(*sets[1:])
+        for label in not_labels:
+            matched -= self.by_label.get(label, set())
+        return matched
+
+    def query(self, labels, not_labels=()):
+        """Issues that carry every label in labels and none in not_labels, in their original order
+
+        Args:
+            labels (list): Labels that must all be present
+            not_labels (list, optional): Labels that must not be present
+
+        Returns:
+            list: Matching issues
+        """
+        return [self.issues[position] for position in sorted(self.positions(labels, not_labels))]
+
+    def count(self, labels, not_labels=()):
+        """Number of issues that carry every label in labels and none in not_labels"""
+        return len(self.positions(labels, not_labels))
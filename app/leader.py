@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import fcntl
+import itertools
+import threading
+import logging
+import exposition
+from prometheus_client import REGISTRY, generate_latest
+from collector import REFRESH_STATE
+
+logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(format=logFormatter, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LOCK_FILE = "leader.lock"
+SNAPSHOT_FILE = "snapshot.prom"
+LIVE_FILE = "live.prom"
+WEBHOOK_DIR = "webhooks"
+
+# Seconds between two attempts of a follower to take over, and between two writes of the leader's
+# own metrics.  A newly rendered snapshot is written within POLL_INTERVAL.
+ELECTION_INTERVAL = 5
+LIVE_INTERVAL = 5
+POLL_INTERVAL = 1
+
+LEADER_STATE = {
+    "pid": None,
+    "elected": None,
+    "webhooks_forwarded": 0
+}
+
+
+def write_atomic(path, data):
+    """Write a file so readers see either the old or the new content, never part of it"""
+    temporary = "{}.{}.tmp".format(path, os.getpid())
+    with open(temporary, "wb") as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+class SharedCollector:
+    """One collector for all the worker processes of a server.  The worker holding the lock file in
+    the shared directory collects, the others serve what it writes there.  When the leader exits the
+    lock is released and the next follower to try takes over.
+
+    Args:
+        directory (str): Directory shared by the workers, None to collect in every process
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.is_leader = False
+        self._lock_file = None
+        self._published = None
+        # (inode, mtime, size) of the snapshot file last read
+        self._loaded = None
+        self._webhook_ids = itertools.count()
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def try_lead(self):
+        """Take the leader lock if no other worker holds it
+
+        Returns:
+            bool: True when this worker is the leader
+        """
+        if self._lock_file is None:
+            os.makedirs(self.path(WEBHOOK_DIR), exist_ok=True)
+            self._lock_file = open(self.path(LOCK_FILE), "a")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        self.is_leader = True
+        LEADER_STATE['pid'] = os.getpid()
+        LEADER_STATE['elected'] = time.time()
+        return True
+
+    def start(self, lead, handle_webhook):
+        """Follow until this worker gets the lock, then lead, in the background
+
+        Args:
+            lead (function): Starts collecting, called once this worker is the leader
+            handle_webhook (function): Applies a webhook payload, for webhooks forwarded by followers
+
+        Returns:
+            Thread: The election thread
+        """
+        def run():
+            while not self.try_lead():
+                time.sleep(ELECTION_INTERVAL)
+            logger.info("Worker {} is the leader, collecting for every worker".format(os.getpid()))
+            lead()
+            self.publish_loop(handle_webhook)
+
+        thread = threading.Thread(target=run, name="gitlabkpis-leader", daemon=True)
+        thread.start()
+        return thread
+
+    def publish_loop(self, handle_webhook):
+        """Leader side: write every newly rendered snapshot and, every LIVE_INTERVAL seconds, the
+        leader's own metrics, and apply the webhooks followers forwarded"""
+        live_written = 0
+        while True:
+            try:
+                rendered = exposition.current()
+                if REFRESH_STATE['ready_after'] is not None and rendered is not self._published:
+                    write_atomic(self.path(SNAPSHOT_FILE), rendered.body)
+                    self._published = rendered
+                if time.time() - live_written >= LIVE_INTERVAL:
+                    write_atomic(self.path(LIVE_FILE), generate_latest(REGISTRY))
+                    live_written = time.time()
+                self.drain_webhooks(handle_webhook)
+            except Exception:
+                logger.exception("Could not publish to {}".format(self.directory))
+            time.sleep(POLL_INTERVAL)
+
+    def sync(self):
+        """Follower side: load the snapshot file when the leader wrote a new one"""
+        if not self.enabled or self.is_leader:
+            return
+        try:
+            stat = os.stat(self.path(SNAPSHOT_FILE))
+        except FileNotFoundError:
+            return
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key == self._loaded:
+            return
+        with open(self.path(SNAPSHOT_FILE), "rb") as f:
+            exposition.RENDERED = exposition.RenderedSnapshot(f.read())
+        self._loaded = key
+        if REFRESH_STATE['ready_after'] is None:
+            REFRESH_STATE['ready_after'] = time.time() - REFRESH_STATE['started']
+
+    def render_live(self):
+        """The leader's own metrics as last written, this worker's until there are some"""
+        try:
+            with open(self.path(LIVE_FILE), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return generate_latest(REGISTRY)
+
+    def metrics_response(self, request):
+        """/metrics for any worker.  Followers serve the leader's snapshot and own metrics, so every
+        worker answers a scrape the same way"""
+        if not self.enabled or self.is_leader:
+            return exposition.metrics_response(request)
+        self.sync()
+        return exposition.snapshot_response(request, exposition.RENDERED, self.render_live)
+
+    def forward_webhook(self, payload):
+        """Follower side: leave a webhook in the shared directory for the leader to apply
+
+        Args:
+            payload (dict): Webhook body
+        """
+        name = "{:020d}-{}-{}.json".format(time.time_ns(), os.getpid(), next(self._webhook_ids))
+        write_atomic(os.path.join(self.path(WEBHOOK_DIR), name), json.dumps(payload).encode())
+
+    def drain_webhooks(self, handle_webhook):
+        """Leader side: apply the forwarded webhooks, oldest first"""
+        directory = self.path(WEBHOOK_DIR)
+        for name in sorted(name for name in os.listdir(directory) if name.endswith(".json")):
+            path = os.path.join(directory, name)
+            try:
+                with open(path) as f:
+                    handle_webhook(json.load(f))
+            except Exception:
+                logger.exception("Forwarded webhook {} failed".format(name))
+            os.remove(path)
+            LEADER_STATE['webhooks_forwarded'] += 1
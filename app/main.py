@@ -1,14 +1,29 @@
 from logging import Logger
 import logging
-from fastapi import FastAPI
-from retro import run_retro2, get_group_issues, iteration_summarize_status,get_issue_counts
-from retro import iteration_based_metrics,get_releases,run_team_issue_activity
-from titan import titan_wide
-import requests
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from retro import get_group_issues,get_backlog_counts,fetch_issues
+from retro import get_releases,run_team_issue_activity,count_eng_done,LABEL_EVENT_CACHE,LABEL_EVENT_FETCHES,ISSUE_STORE,SYNC_STATS
+from aggregate import aggregate_issues
+from labels import LabelIndex, reset_classifiers
+from project_status import collect_project_status, PROJECT_STATS
+from collector import MetricSnapshot, REFRESH_STATE, snapshot_age, start_refresh_thread, apply_snapshot, apply_delta, applied_snapshot, request_refresh, refresh_requested
+from config_loader import ConfigSource, CONFIG_STATE
+from webhooks import WEBHOOK_STATS, verify_token, apply_issue_event
+from history import ITERATION_HISTORY, HISTORY_STATS, collect_history
+from leader import SharedCollector, LEADER_STATE
+import store
+from exposition import SNAPSHOT_REGISTRY, CounterCollector
+from instrumentation import stage, timed_stage
+import gitlab_client
+import asyncio
+import functools
+from collections import Counter
+import threading
 import os
 import json
-from starlette_exporter import PrometheusMiddleware, handle_metrics
-from prometheus_client import Gauge, Info
+from starlette_exporter import PrometheusMiddleware
+from prometheus_client import Gauge, Info, REGISTRY
 
 logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
 logging.basicConfig(format=logFormatter, level=logging.INFO)
@@ -23,196 +38,596 @@ async def read_root():
 
 ### Gitlab Setup
 project = {
-    "GITLAB_URL":'https://gitlab.com/api/v4/',
+    "GITLAB_URL": os.environ.get("GITLAB_URL", 'https://gitlab.com/api/v4/'),
     "GITLAB_PROJECT_ID": os.environ.get("CONFIG_PROJECT_ID"),
     "GITLAB_HEADERS": { 
             "PRIVATE-TOKEN": os.environ.get("GL_ACCESS_TOKEN") 
     },
     "CONFIG_FILE": os.environ.get("CONFIG_FILENAME"),
-    "BRANCH_NAME": os.environ.get("CONFIG_BRANCH")
+    "BRANCH_NAME": os.environ.get("CONFIG_BRANCH"),
+    "WEBHOOK_SECRET": os.environ.get("WEBHOOK_SECRET")
 }
 
-CONFIG_MAP = requests.get(
-    project['GITLAB_URL'] + "projects/{}/repository/files/{}/raw?ref={}".format(project['GITLAB_PROJECT_ID'],project['CONFIG_FILE'],project['BRANCH_NAME']),
-    headers=project['GITLAB_HEADERS'],
-    verify=True
-).json()
-CONFIG_MAP.update(project)
-
-groupName = CONFIG_MAP['team_label'].replace(" ","_")
-
-ISSUE_WEIGHT = Gauge("gitlabkpis_Users_by_weight","Issue Weight by User",["group","iteration","team","user"])
-ISSUE_STATUS = Gauge("gitlabkpis_Issues_by_status","Issue Counts by Status",["group","iteration","team","status"])
-TIME_ESTIMATE = Gauge("gitlabkpis_time_estimate","Time Estimated by User",["group","iteration","team","user"])
-TIME_SPENT = Gauge("gitlabkpis_time_spent","Time Spent by User",["group","iteration","team","user"])
-TICKETS_USER = Gauge("gitlabkpis_tickets_by_user","Ticket Count by User",["group","iteration","team","user"])
-TICKETS_CLOSED_USER = Gauge("gitlabkpis_tickets_closed_by_user","Ticket Closed by User (engineering complete)",["group","iteration","team","user"])
-TICKETS_COMPLETE_USER = Gauge("gitlabkpis_tickets_completed_by_user","Ticket Closed by User (Dev GS::Done)",["group","iteration","team","user"])
-
-
-BACKLOG_ISSUE_COUNT = Gauge("gitlabkpis_summary_issue_backlog_count","Number of issues in the Backlog",["group","team"])
-ITERATION_ISSUE_COUNT = Gauge("gitlabkpis_summary_issue_count","Number of issues in the iteration",["group","iteration","team"])
-ITERATION_WEIGHT = Gauge("gitlabkpis_summary_weight","Iteration issues weight",["group","iteration"])
-ITERATION_LABEL_WEIGHT = Gauge("gitlabkpis_summary_label_weight","Iteration weight by label",["group","iteration","status"])
-ITERATION_TIME_ESTIMATE = Gauge("gitlabkpis_summary_time_estimate","Time Estimated during Iteration",["group","iteration"])
-ITERATION_TIME_SPENT = Gauge("gitlabkpis_summary_time_spent","Time Spent during iteration",["group","iteration"])
-ITERATION_TIME_ESTIMATE_LABEL = Gauge("gitlabkpis_summary_time_estimate_by_status","Time Estimated during Iteration by label",["group","iteration","status"])
-ITERATION_TIME_SPENT_LABEL = Gauge("gitlabkpis_summary_time_spent_by_status","Time Spent during iteration by label",["group","iteration","status"])
-ITERATION_LABEL_CLASSIFICATION = Gauge("gitlabkpis_summary_issuegs_classification","Iteration weight by label",["group","iteration","team","status"])
-ITERATION_COUNT_SEVERITY = Gauge("gitlabkpis_summary_count_severity","Ticket Count by Severity",["group","iteration","team","severity"])
-ITERATION_COUNT_PRIORITY = Gauge("gitlabkpis_summary_count_priority","Ticket Count by Priority",["group","iteration","team","priority"])
-ITERATION_MILESTONE_COUNT = Gauge("gitlabkpis_summary_count_milestone","Ticket Count by Milestone",["group","iteration","team","milestone"])
-ITERATION_EPIC_COUNT = Gauge("gitlabkpis_summary_count_epic","Ticket Count by Epic",["group","iteration","team","epic"])
-RELEASES_INFO = Info("gitlabkpis_summary_releases","Current Release and Release Counts")
-VULN_SEV_INFO = Gauge("gitlabkpis_summary_vuln_severity","Vulnerability Counts by Severity",["group",'severity'])
-VULN_SCANNER_INFO = Gauge("gitlabkpis_summary_vuln_scanner","Vulnerability Counts by Scanner",["group",'scanner'])
-VULN_DETAILS_INFO = Gauge("gitlabkpis_summary_vuln_details","Vulnerability Counts by Scanner and Severity",["group",'scanner','severity'])
-BUILD_STATUS_SUMMARY = Gauge("gitlabkpis_summary_build_status","Summary of Build status across all projects",["group",'status'])
-BUILD_STATUS_PROJECTS = Gauge("gitlabkpis_project_build_status","Build status broken down by project",["group",'project','status'])
-
-
-
-def build_metrics(request):
-
-    ISSUE_WEIGHT.clear()
-    ISSUE_STATUS.clear()
-    TIME_ESTIMATE.clear()
-    TIME_SPENT.clear()
-    TICKETS_USER.clear()
-
-    ITERATION_ISSUE_COUNT.clear()
-    ITERATION_WEIGHT.clear()
-    ITERATION_LABEL_WEIGHT.clear()
-    ITERATION_TIME_ESTIMATE.clear()
-    ITERATION_TIME_SPENT.clear()
-    ITERATION_TIME_ESTIMATE_LABEL.clear()
-    ITERATION_TIME_SPENT_LABEL.clear()
-    ITERATION_LABEL_CLASSIFICATION.clear()
-    ITERATION_COUNT_SEVERITY.clear()
-    ITERATION_COUNT_PRIORITY.clear()
-    ITERATION_MILESTONE_COUNT.clear()
-    ITERATION_EPIC_COUNT.clear()
-    TICKETS_CLOSED_USER.clear()
-    TICKETS_COMPLETE_USER.clear()
-    RELEASES_INFO.clear()
-    BACKLOG_ISSUE_COUNT.clear()
-    VULN_SEV_INFO.clear()
-    VULN_SCANNER_INFO.clear()
-    VULN_DETAILS_INFO.clear()
-    BUILD_STATUS_SUMMARY.clear()
-    BUILD_STATUS_PROJECTS.clear()
+def group_name(CONFIG_MAP):
+    """Value of the group label on every series collected for a config"""
+    return CONFIG_MAP['team_label'].replace(" ","_")
 
-    logger.info("Getting Group Issues")
-    (gl_issues,retroName) = get_group_issues(CONFIG_MAP)
-    
-    logger.info("Pulling Iteration Summary Status")
-    (issue_summary_status,priority_tally,severity_tally) = iteration_summarize_status(gl_issues,CONFIG_MAP)
+
+CONFIG_SOURCE = ConfigSource(project, os.environ.get("CONFIG_LOCAL"), os.environ.get("CONFIG_CACHE"))
+# With SHARED_DIR set only one worker process collects, see leader.SharedCollector
+LEADER = SharedCollector(os.environ.get("SHARED_DIR"))
+CONFIG_MAPS = []
+# Process wide settings (http_*, refresh_interval, store_*) come from the first config
+CONFIG_MAP = {}
+
+
+def use_configs(configs):
+    """Switch to a new set of configs, at startup or after a reload.  Label classifiers are rebuilt
+    from the new config on first use, and series of teams or groups that are gone drop out with the
+    next refresh.
+
+    Args:
+        configs (list): Configurations
+    """
+    global CONFIG_MAPS, CONFIG_MAP
+    CONFIG_MAPS = configs
+    CONFIG_MAP = configs[0]
+    gitlab_client.configure(CONFIG_MAP)
+    reset_classifiers()
+
+
+def reload_config():
+    """Fetch the remote config and switch to it if it changed
+
+    Returns:
+        bool: True when the config changed
+    """
+    if not CONFIG_SOURCE.fetch():
+        return False
+    use_configs(CONFIG_SOURCE.configs)
+    return True
+
+
+# Local files only, startup does not wait on GitLab
+if CONFIG_SOURCE.load_initial():
+    use_configs(CONFIG_SOURCE.configs)
+
+ISSUE_WEIGHT = Gauge("gitlabkpis_Users_by_weight","Issue Weight by User",["group","iteration","team","user"],registry=SNAPSHOT_REGISTRY)
+ISSUE_STATUS = Gauge("gitlabkpis_Issues_by_status","Issue Counts by Status",["group","iteration","team","status"],registry=SNAPSHOT_REGISTRY)
+TIME_ESTIMATE = Gauge("gitlabkpis_time_estimate","Time Estimated by User",["group","iteration","team","user"],registry=SNAPSHOT_REGISTRY)
+TIME_SPENT = Gauge("gitlabkpis_time_spent","Time Spent by User",["group","iteration","team","user"],registry=SNAPSHOT_REGISTRY)
+TICKETS_USER = Gauge("gitlabkpis_tickets_by_user","Ticket Count by User",["group","iteration","team","user"],registry=SNAPSHOT_REGISTRY)
+TICKETS_CLOSED_USER = Gauge("gitlabkpis_tickets_closed_by_user","Ticket Closed by User (engineering complete)",["group","iteration","team","user"],registry=SNAPSHOT_REGISTRY)
+TICKETS_COMPLETE_USER = Gauge("gitlabkpis_tickets_completed_by_user","Ticket Closed by User (Dev GS::Done)",["group","iteration","team","user"],registry=SNAPSHOT_REGISTRY)
+
+
+BACKLOG_ISSUE_COUNT = Gauge("gitlabkpis_summary_issue_backlog_count","Number of issues in the Backlog",["group","team"],registry=SNAPSHOT_REGISTRY)
+ITERATION_ISSUE_COUNT = Gauge("gitlabkpis_summary_issue_count","Number of issues in the iteration",["group","iteration","team"],registry=SNAPSHOT_REGISTRY)
+ITERATION_WEIGHT = Gauge("gitlabkpis_summary_weight","Iteration issues weight",["group","iteration"],registry=SNAPSHOT_REGISTRY)
+ITERATION_LABEL_WEIGHT = Gauge("gitlabkpis_summary_label_weight","Iteration weight by label",["group","iteration","status"],registry=SNAPSHOT_REGISTRY)
+ITERATION_TIME_ESTIMATE = Gauge("gitlabkpis_summary_time_estimate","Time Estimated during Iteration",["group","iteration"],registry=SNAPSHOT_REGISTRY)
+ITERATION_TIME_SPENT = Gauge("gitlabkpis_summary_time_spent","Time Spent during iteration",["group","iteration"],registry=SNAPSHOT_REGISTRY)
+ITERATION_TIME_ESTIMATE_LABEL = Gauge("gitlabkpis_summary_time_estimate_by_status","Time Estimated during Iteration by label",["group","iteration","status"],registry=SNAPSHOT_REGISTRY)
+ITERATION_TIME_SPENT_LABEL = Gauge("gitlabkpis_summary_time_spent_by_status","Time Spent during iteration by label",["group","iteration","status"],registry=SNAPSHOT_REGISTRY)
+ITERATION_LABEL_CLASSIFICATION = Gauge("gitlabkpis_summary_issuegs_classification","Iteration weight by label",["group","iteration","team","status"],registry=SNAPSHOT_REGISTRY)
+ITERATION_COUNT_SEVERITY = Gauge("gitlabkpis_summary_count_severity","Ticket Count by Severity",["group","iteration","team","severity"],registry=SNAPSHOT_REGISTRY)
+ITERATION_COUNT_PRIORITY = Gauge("gitlabkpis_summary_count_priority","Ticket Count by Priority",["group","iteration","team","priority"],registry=SNAPSHOT_REGISTRY)
+ITERATION_MILESTONE_COUNT = Gauge("gitlabkpis_summary_count_milestone","Ticket Count by Milestone",["group","iteration","team","milestone"],registry=SNAPSHOT_REGISTRY)
+ITERATION_EPIC_COUNT = Gauge("gitlabkpis_summary_count_epic","Ticket Count by Epic",["group","iteration","team","epic"],registry=SNAPSHOT_REGISTRY)
+RELEASES_INFO = Info("gitlabkpis_summary_releases","Current Release and Release Counts",["group"],registry=SNAPSHOT_REGISTRY)
+VULN_SEV_INFO = Gauge("gitlabkpis_summary_vuln_severity","Vulnerability Counts by Severity",["group",'severity'],registry=SNAPSHOT_REGISTRY)
+VULN_SCANNER_INFO = Gauge("gitlabkpis_summary_vuln_scanner","Vulnerability Counts by Scanner",["group",'scanner'],registry=SNAPSHOT_REGISTRY)
+VULN_DETAILS_INFO = Gauge("gitlabkpis_summary_vuln_details","Vulnerability Counts by Scanner and Severity",["group",'scanner','severity'],registry=SNAPSHOT_REGISTRY)
+BUILD_STATUS_SUMMARY = Gauge("gitlabkpis_summary_build_status","Summary of Build status across all projects",["group",'status'],registry=SNAPSHOT_REGISTRY)
+BUILD_STATUS_PROJECTS = Gauge("gitlabkpis_project_build_status","Build status broken down by project",["group",'project','status'],registry=SNAPSHOT_REGISTRY)
+
+
+
+SNAPSHOT_AGE = Gauge("gitlabkpis_snapshot_age_seconds","Seconds since the last successful refresh")
+REFRESH_DURATION = Gauge("gitlabkpis_refresh_duration_seconds","Duration of the last successful refresh")
+SNAPSHOT_AGE.set_function(snapshot_age)
+REFRESH_DURATION.set_function(lambda: REFRESH_STATE['last_duration'] or 0)
+
+SCHEDULER_QUEUE = Gauge("gitlabkpis_scheduler_queue_depth","GitLab requests waiting for a slot")
+SCHEDULER_LIMIT = Gauge("gitlabkpis_scheduler_concurrency","GitLab requests currently allowed in flight")
+SCHEDULER_QUEUE.set_function(lambda: gitlab_client.scheduler.queue_depth)
+SCHEDULER_LIMIT.set_function(lambda: gitlab_client.scheduler.limit)
+
+LABEL_EVENT_CACHE_SIZE = Gauge("gitlabkpis_cache_label_events_size","Issues held in the label event cache")
+LABEL_EVENT_CACHE_SIZE.set_function(lambda: len(LABEL_EVENT_CACHE))
+
+SYNC_HELD = Gauge("gitlabkpis_sync_issues_held","Issues held in the local issue store")
+SYNC_HELD.set_function(lambda: sum(len(entry['issues']) for entry in list(ISSUE_STORE.values())))
+
+STARTUP_CONFIG = Gauge("gitlabkpis_startup_config_seconds","Seconds from start until a config was loaded")
+STARTUP_READY = Gauge("gitlabkpis_startup_ready_seconds","Seconds from start until /metrics had a snapshot to serve")
+STARTUP_CONFIG.set_function(lambda: float('nan') if CONFIG_STATE['ready_after'] is None else CONFIG_STATE['ready_after'])
+STARTUP_READY.set_function(lambda: float('nan') if REFRESH_STATE['ready_after'] is None else REFRESH_STATE['ready_after'])
+
+LEADER_PID = Gauge("gitlabkpis_leader_pid","Process id of the worker collecting for every worker, NaN without SHARED_DIR")
+LEADER_PID.set_function(lambda: float('nan') if LEADER_STATE['pid'] is None else LEADER_STATE['pid'])
+
+HISTORY_HELD = Gauge("gitlabkpis_history_iterations_held","Closed iterations held in the history cache")
+HISTORY_HELD.set_function(lambda: len(ITERATION_HISTORY))
+
+# Counts that only go up, kept as plain numbers by the modules and exposed as counters (name_total)
+REGISTRY.register(CounterCollector([
+    ("gitlabkpis_http_requests","Requests sent to GitLab through the shared connection pool",lambda: gitlab_client.connection_stats()['requests']),
+    ("gitlabkpis_http_connections_opened","Connections opened to GitLab by the shared connection pool",lambda: gitlab_client.connection_stats()['connections']),
+    ("gitlabkpis_http_connections_reused","Requests to GitLab that reused a pooled connection",lambda: gitlab_client.connection_stats()['reused']),
+    ("gitlabkpis_http_requests_shared","GitLab requests and issue syncs answered by an identical one made during the same refresh",lambda: gitlab_client.SHARED.shared + LABEL_EVENT_FETCHES.shared),
+    ("gitlabkpis_scheduler_throttle_seconds","Seconds GitLab requests spent held back by rate limiting",lambda: gitlab_client.scheduler.throttle_seconds),
+    ("gitlabkpis_scheduler_throttled_requests","GitLab requests held back by rate limiting",lambda: gitlab_client.scheduler.throttled),
+    ("gitlabkpis_cache_label_events_hits","Issues whose label events were served from the cache",lambda: LABEL_EVENT_CACHE.hits),
+    ("gitlabkpis_cache_label_events_misses","Issues whose label events had to be fetched",lambda: LABEL_EVENT_CACHE.misses),
+    ("gitlabkpis_sync_full","Full issue syncs since start",lambda: SYNC_STATS['full']),
+    ("gitlabkpis_sync_incremental","Incremental issue syncs since start",lambda: SYNC_STATS['incremental']),
+    ("gitlabkpis_sync_issues_fetched","Issues transferred from GitLab by issue syncs since start",lambda: SYNC_STATS['fetched']),
+    ("gitlabkpis_webhooks_received","GitLab webhooks received with a valid token",lambda: WEBHOOK_STATS['received']),
+    ("gitlabkpis_webhooks_applied","Issue webhooks applied to the issue store",lambda: WEBHOOK_STATS['applied']),
+    ("gitlabkpis_webhooks_rejected","Webhooks refused for a missing or wrong token",lambda: WEBHOOK_STATS['rejected']),
+    ("gitlabkpis_config_reloads","Config changes picked up without a restart",lambda: CONFIG_STATE['reloads']),
+    ("gitlabkpis_config_fetch_failures","Remote config fetches that failed",lambda: CONFIG_STATE['failures']),
+    ("gitlabkpis_projects_fetched","Projects whose vulnerabilities and pipeline were fetched since start",lambda: PROJECT_STATS['fetched']),
+    ("gitlabkpis_projects_skipped","Projects skipped for showing no activity since the last pass, since start",lambda: PROJECT_STATS['skipped']),
+    ("gitlabkpis_projects_failed","Project fetches that failed since start, the project keeps its last status",lambda: PROJECT_STATS['failed']),
+    ("gitlabkpis_leader_webhooks_forwarded","Webhooks received by other workers and applied by the leader",lambda: LEADER_STATE['webhooks_forwarded']),
+    ("gitlabkpis_history_iterations_computed","Closed iterations worked out from GitLab since start",lambda: HISTORY_STATS['computed']),
+    ("gitlabkpis_history_iterations_reused","Closed iterations served from the history cache since start",lambda: HISTORY_STATS['reused'])
+]))
+
+
+SNAPSHOT_GAUGES = [
+    ISSUE_WEIGHT, ISSUE_STATUS, TIME_ESTIMATE, TIME_SPENT, TICKETS_USER, TICKETS_CLOSED_USER, TICKETS_COMPLETE_USER,
+    BACKLOG_ISSUE_COUNT, ITERATION_ISSUE_COUNT, ITERATION_WEIGHT, ITERATION_LABEL_WEIGHT, ITERATION_TIME_ESTIMATE,
+    ITERATION_TIME_SPENT, ITERATION_TIME_ESTIMATE_LABEL, ITERATION_TIME_SPENT_LABEL, ITERATION_LABEL_CLASSIFICATION,
+    ITERATION_COUNT_SEVERITY, ITERATION_COUNT_PRIORITY, ITERATION_MILESTONE_COUNT, ITERATION_EPIC_COUNT,
+    VULN_SEV_INFO, VULN_SCANNER_INFO, VULN_DETAILS_INFO, BUILD_STATUS_SUMMARY, BUILD_STATUS_PROJECTS
+]
+SNAPSHOT_INFOS = [RELEASES_INFO]
+# Worked out from the iteration issues alone, a webhook updates these without a refresh
+ISSUE_GAUGES = [
+    ISSUE_WEIGHT, ISSUE_STATUS, TIME_ESTIMATE, TIME_SPENT, TICKETS_USER, TICKETS_CLOSED_USER, TICKETS_COMPLETE_USER,
+    ITERATION_ISSUE_COUNT, ITERATION_WEIGHT, ITERATION_LABEL_WEIGHT, ITERATION_TIME_ESTIMATE, ITERATION_TIME_SPENT,
+    ITERATION_TIME_ESTIMATE_LABEL, ITERATION_TIME_SPENT_LABEL, ITERATION_LABEL_CLASSIFICATION, ITERATION_COUNT_SEVERITY,
+    ITERATION_COUNT_PRIORITY, ITERATION_MILESTONE_COUNT, ITERATION_EPIC_COUNT
+]
+WEBHOOK_LOCK = threading.Lock()
+# Configs of the collection running or last run, a reload only needs a refresh when they differ
+COLLECTING = {"configs": None, "store_loaded": False}
+COLLECTING_LOCK = threading.Lock()
+
+
+def refresh_interval():
+    return int(CONFIG_MAP.get('refresh_interval', 300))
+
+
+def config_reload_interval():
+    return int(CONFIG_MAP.get('config_reload_interval', 300))
+
+
+async def in_thread(func, *args):
+    """Run a blocking collector function on the default executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+
+def set_issue_metrics(CONFIG_MAP, snapshot, gl_issues, retroName, aggregated, eng_done):
+    """Record every series worked out from the iteration issues
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        snapshot (MetricSnapshot): Snapshot to add the series to
+        gl_issues (list): Issues in the iteration
+        retroName (str): Iteration name
+        aggregated (dict): aggregate_issues over gl_issues
+        eng_done (dict): Team -> engineering complete count by user, empty without issue_activity
+    """
+    groupName = group_name(CONFIG_MAP)
+
+    (issue_summary_status,priority_tally,severity_tally) = aggregated['summary']
     for status in issue_summary_status:
-        ISSUE_STATUS.labels(groupName,retroName,"coredev",status).set(issue_summary_status[status])
+        snapshot.set(ISSUE_STATUS,(groupName,retroName,"coredev",status),issue_summary_status[status])
     
     for priority in priority_tally:
-        ITERATION_COUNT_PRIORITY.labels(groupName,retroName,"coredev",priority).set(priority_tally[priority])
+        snapshot.set(ITERATION_COUNT_PRIORITY,(groupName,retroName,"coredev",priority),priority_tally[priority])
     for severity in severity_tally:
-        ITERATION_COUNT_PRIORITY.labels(groupName,retroName,"coredev",severity).set(severity_tally[severity])
+        snapshot.set(ITERATION_COUNT_PRIORITY,(groupName,retroName,"coredev",severity),severity_tally[severity])
 
     # Issue count in Iteration
-    ITERATION_ISSUE_COUNT.labels(groupName,retroName,"total").set(len(gl_issues))
-
-    logger.info("Getting Issue Counts metric")
-    (total_issues) = get_issue_counts(CONFIG_MAP,gl_issues)
+    snapshot.set(ITERATION_ISSUE_COUNT,(groupName,retroName,"total"),len(gl_issues))
 
     for team in CONFIG_MAP['teams']:
-        ITERATION_ISSUE_COUNT.labels(groupName,retroName,team).set(total_issues[team]['iteration'])
-        BACKLOG_ISSUE_COUNT.labels(groupName,team).set(total_issues[team]['backlog'])
+        snapshot.set(ITERATION_ISSUE_COUNT,(groupName,retroName,team),aggregated['counts'][team])
 
-    logger.info("Fetching Iteration based Metrics")
-    (iteration_weight, label_weights,timeestimate,timespent,timesestimate_tally,timespent_tally,epic_tally_all,milestone_tally_all) = iteration_based_metrics(gl_issues,CONFIG_MAP)
+    (iteration_weight, label_weights,timeestimate,timespent,timesestimate_tally,timespent_tally,epic_tally_all,milestone_tally_all) = aggregated['iteration']
     #Overall weight of the iteration
-    ITERATION_WEIGHT.labels(groupName,retroName).set(iteration_weight)
+    snapshot.set(ITERATION_WEIGHT,(groupName,retroName),iteration_weight)
 
     #Overall Time estimated in the iteration
-    ITERATION_TIME_ESTIMATE.labels(groupName,retroName).set(timeestimate)
+    snapshot.set(ITERATION_TIME_ESTIMATE,(groupName,retroName),timeestimate)
 
     #Overall time spend in the iteration
-    ITERATION_TIME_SPENT.labels(groupName,retroName).set(timespent)
+    snapshot.set(ITERATION_TIME_SPENT,(groupName,retroName),timespent)
 
     # Time estimate by label 
     for status in timesestimate_tally:
-        ITERATION_TIME_ESTIMATE_LABEL.labels(groupName,retroName, status).set(timesestimate_tally[status])
+        snapshot.set(ITERATION_TIME_ESTIMATE_LABEL,(groupName,retroName, status),timesestimate_tally[status])
     
     #Time spent by label
     for status in timespent_tally:
-        ITERATION_TIME_SPENT_LABEL.labels(groupName,retroName,status).set(timespent_tally[status])
+        snapshot.set(ITERATION_TIME_SPENT_LABEL,(groupName,retroName,status),timespent_tally[status])
 
     # Weight for a given label
     for label in label_weights:
-        ITERATION_LABEL_WEIGHT.labels(groupName,retroName,label).set(label_weights[label])
+        snapshot.set(ITERATION_LABEL_WEIGHT,(groupName,retroName,label),label_weights[label])
     
     # Epic counts for Iteration
     for epic in epic_tally_all:
-        ITERATION_EPIC_COUNT.labels(groupName,retroName,"coredev",epic).set(epic_tally_all[epic])
+        snapshot.set(ITERATION_EPIC_COUNT,(groupName,retroName,"coredev",epic),epic_tally_all[epic])
     # Milestone counts for Iteration
     for milestone in milestone_tally_all:
-        ITERATION_MILESTONE_COUNT.labels(groupName,retroName,"coredev",milestone).set(milestone_tally_all[milestone])
-    
-    # Release Information
-    if CONFIG_MAP['release_status'] == 1:
-        logger.info("Getting Release Information")
-        releases = get_releases(CONFIG_MAP)
-        RELEASES_INFO.info({'version': releases['current'], 'release_date': releases['current_date'], 'short_date': releases['short_date'], "group": groupName})
-
-
-    # Vuln Data
-    if CONFIG_MAP['vuln_status'] == 1 or CONFIG_MAP['pipeline_status']:
-        logger.info("Getting Vuln Information")
-        titan_wide_status = titan_wide(CONFIG_MAP)
-        for sev in titan_wide_status['vuln_sev']:
-            VULN_SEV_INFO.labels(groupName,sev).set(titan_wide_status['vuln_sev'][sev])
-        for scanner in titan_wide_status['vuln_scanner']:
-            VULN_SCANNER_INFO.labels(groupName,scanner).set(titan_wide_status['vuln_scanner'][scanner])
-        for scanner in titan_wide_status['vuln_details']:
-            for sev in titan_wide_status['vuln_details'][scanner]:
-                VULN_DETAILS_INFO.labels(groupName,scanner,sev).set(titan_wide_status['vuln_details'][scanner][sev])
-
-    # Build Status
-    if CONFIG_MAP['pipeline_status'] == 1:
-        logger.info("Getting Build Status")
-        for status in titan_wide_status['pipeline_status']:
-            BUILD_STATUS_SUMMARY.labels(groupName,status).set(titan_wide_status['pipeline_status'][status])
+        snapshot.set(ITERATION_MILESTONE_COUNT,(groupName,retroName,"coredev",milestone),milestone_tally_all[milestone])
 
     # Team based
     for team in CONFIG_MAP['teams']:
         logger.info("Fetching info for {}".format(team))
-        (issue_weights_fe,time_spent_fe,time_estimate_fe,tickets_by_user_fe,issue_status_fe,label_class_fe,priority_fe,severity_fe,milestone_tally,epic_tally,user_closed_tally) = run_retro2(team,gl_issues,CONFIG_MAP)
+        (issue_weights_fe,time_spent_fe,time_estimate_fe,tickets_by_user_fe,issue_status_fe,label_class_fe,priority_fe,severity_fe,milestone_tally,epic_tally,user_closed_tally) = aggregated['teams'][team]
         
         for status in tickets_by_user_fe:
-            TICKETS_USER.labels(groupName,retroName,team,status).set(tickets_by_user_fe[status])
+            snapshot.set(TICKETS_USER,(groupName,retroName,team,status),tickets_by_user_fe[status])
             
         for x in issue_status_fe:
-            ISSUE_STATUS.labels(groupName,retroName,team,x).set(issue_status_fe[x])
+            snapshot.set(ISSUE_STATUS,(groupName,retroName,team,x),issue_status_fe[x])
         for y in issue_weights_fe:
-            ISSUE_WEIGHT.labels(groupName,retroName,team,y).set(issue_weights_fe[y])
+            snapshot.set(ISSUE_WEIGHT,(groupName,retroName,team,y),issue_weights_fe[y])
         for z in time_estimate_fe:
-            TIME_ESTIMATE.labels(groupName,retroName,team,z).set(time_estimate_fe[z])
+            snapshot.set(TIME_ESTIMATE,(groupName,retroName,team,z),time_estimate_fe[z])
         for user in time_spent_fe:
-            TIME_SPENT.labels(groupName,retroName,team,user).set(time_spent_fe[user])
+            snapshot.set(TIME_SPENT,(groupName,retroName,team,user),time_spent_fe[user])
         for status in label_class_fe:
-            ITERATION_LABEL_CLASSIFICATION.labels(groupName,retroName,team,status).set(label_class_fe[status])
+            snapshot.set(ITERATION_LABEL_CLASSIFICATION,(groupName,retroName,team,status),label_class_fe[status])
         for priority in priority_fe:
-            ITERATION_COUNT_PRIORITY.labels(groupName,retroName,team,priority).set(priority_fe[priority])
+            snapshot.set(ITERATION_COUNT_PRIORITY,(groupName,retroName,team,priority),priority_fe[priority])
         for severity in severity_fe:
-            ITERATION_COUNT_PRIORITY.labels(groupName,retroName,team,severity).set(severity_fe[severity])
+            snapshot.set(ITERATION_COUNT_PRIORITY,(groupName,retroName,team,severity),severity_fe[severity])
         for milestone in milestone_tally:
-            ITERATION_MILESTONE_COUNT.labels(groupName,retroName,team,milestone).set(milestone_tally[milestone])
+            snapshot.set(ITERATION_MILESTONE_COUNT,(groupName,retroName,team,milestone),milestone_tally[milestone])
         for epic in epic_tally:
-            ITERATION_EPIC_COUNT.labels(groupName,retroName,team,epic).set(epic_tally[epic])
-        if CONFIG_MAP['issue_activity'] == 1:
-            engDone = run_team_issue_activity(team,gl_issues,CONFIG_MAP)
+            snapshot.set(ITERATION_EPIC_COUNT,(groupName,retroName,team,epic),epic_tally[epic])
+        if team in eng_done:
+            engDone = eng_done[team]
             for user in engDone:
-                TICKETS_CLOSED_USER.labels(groupName,retroName,team,user).set(engDone[user])
+                snapshot.set(TICKETS_CLOSED_USER,(groupName,retroName,team,user),engDone[user])
         for user in user_closed_tally:
-            TICKETS_COMPLETE_USER.labels(groupName,retroName,team,user).set(user_closed_tally[user])
-    logger.info("Finished Metrics")
-    return handle_metrics(request)
+            snapshot.set(TICKETS_COMPLETE_USER,(groupName,retroName,team,user),user_closed_tally[user])
+
+
+async def collect_config(CONFIG_MAP, snapshot):
+    """Pull everything for one config from GitLab into the snapshot.  Sections that do not depend on
+    each other run at the same time, GitLab requests are capped by http_max_in_flight.
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        snapshot (MetricSnapshot): Snapshot to add the config's series to
+    """
+    groupName = group_name(CONFIG_MAP)
+
+    # None of these need the iteration issues, start them straight away
+    logger.info("Getting Backlog Counts metric")
+    backlog_task = asyncio.ensure_future(in_thread(timed_stage("backlog",get_backlog_counts),CONFIG_MAP))
+    releases_task = None
+    if CONFIG_MAP['release_status'] == 1:
+        logger.info("Getting Release Information")
+        releases_task = asyncio.ensure_future(in_thread(timed_stage("releases",get_releases),CONFIG_MAP))
+    project_task = None
+    if CONFIG_MAP['vuln_status'] == 1 or CONFIG_MAP['pipeline_status'] == 1:
+        logger.info("Getting Vuln and Pipeline Information")
+        project_task = asyncio.ensure_future(in_thread(timed_stage("vuln_pipeline",collect_project_status),CONFIG_MAP))
+
+    history_task = None
+    if int(CONFIG_MAP.get('iteration_history', 0)) > 0:
+        logger.info("Getting Closed Iteration History")
+        history_task = asyncio.ensure_future(in_thread(timed_stage("history",collect_history),CONFIG_MAP,closed_iteration_metrics,ISSUE_GAUGES,[]))
+
+    logger.info("Getting Group Issues")
+    (gl_issues,retroName) = await in_thread(get_group_issues,CONFIG_MAP)
     
-app.add_route("/metrics", build_metrics)
+    logger.info("Aggregating Iteration Issues")
+    with stage("team_aggregation"):
+        aggregated = aggregate_issues(gl_issues,CONFIG_MAP)
+        index = LabelIndex(gl_issues)
+
+    eng_done = {}
+    if CONFIG_MAP['issue_activity'] == 1:
+        activity_tasks = [in_thread(timed_stage("issue_activity",run_team_issue_activity),team,gl_issues,CONFIG_MAP,index) for team in CONFIG_MAP['teams']]
+        eng_done = dict(zip(CONFIG_MAP['teams'], await asyncio.gather(*activity_tasks)))
+
+    set_issue_metrics(CONFIG_MAP, snapshot, gl_issues, retroName, aggregated, eng_done)
+
+    if history_task:
+        snapshot.merge(await history_task)
+
+    backlog_counts = await backlog_task
+    for team in CONFIG_MAP['teams']:
+        snapshot.set(BACKLOG_ISSUE_COUNT,(groupName,team),backlog_counts[team])
+
+    # Release Information
+    if releases_task:
+        releases = await releases_task
+        snapshot.info(RELEASES_INFO,(groupName,),{'version': releases['current'], 'release_date': releases['current_date'], 'short_date': releases['short_date']})
+
+
+    if project_task:
+        project_status = await project_task
+
+    # Vuln Data
+    if project_task and CONFIG_MAP['vuln_status'] == 1:
+        for sev in project_status['vuln_sev']:
+            snapshot.set(VULN_SEV_INFO,(groupName,sev),project_status['vuln_sev'][sev])
+        for scanner in project_status['vuln_scanner']:
+            snapshot.set(VULN_SCANNER_INFO,(groupName,scanner),project_status['vuln_scanner'][scanner])
+        for scanner in project_status['vuln_details']:
+            for sev in project_status['vuln_details'][scanner]:
+                snapshot.set(VULN_DETAILS_INFO,(groupName,scanner,sev),project_status['vuln_details'][scanner][sev])
+
+    # Build Status
+    if project_task and CONFIG_MAP['pipeline_status'] == 1:
+        logger.info("Getting Build Status")
+        for status in project_status['pipeline_status']:
+            snapshot.set(BUILD_STATUS_SUMMARY,(groupName,status),project_status['pipeline_status'][status])
+        for (project_path, status) in project_status['pipeline_projects'].items():
+            snapshot.set(BUILD_STATUS_PROJECTS,(groupName,project_path,status),1)
+
+    logger.info("Finished Metrics for {}".format(groupName))
+
+
+async def build_metrics_async(configs):
+    """Collect every config at once into a single snapshot.  They share the connection pool, the issue
+    store and the label event cache, and requests two configs both make are only sent once.  A config
+    that fails keeps the series it had, the others are still refreshed.
+
+    Args:
+        configs (list): Configurations to collect
+
+    Returns:
+        MetricSnapshot: Values to swap into the registry
+    """
+    partials = [MetricSnapshot() for config in configs]
+    with gitlab_client.SHARED.scope():
+        results = await asyncio.gather(*[collect_config(config, partial) for (config, partial) in zip(configs, partials)], return_exceptions=True)
+    snapshot = MetricSnapshot()
+    failed = []
+    for (config, partial, result) in zip(configs, partials, results):
+        if isinstance(result, BaseException):
+            logger.error("Collecting {} failed, keeping its previous series".format(group_name(config)), exc_info=result)
+            failed.append((group_name(config),))
+        else:
+            snapshot.merge(partial)
+    if failed and len(failed) == len(configs):
+        raise RuntimeError("Every config failed to collect")
+    if failed:
+        snapshot.merge(applied_snapshot(SNAPSHOT_GAUGES, SNAPSHOT_INFOS).only(failed))
+    return snapshot
+
+
+def build_metrics():
+    """Run a collection on its own event loop, used from the refresh thread.  Without a local or cached
+    config the first refresh fetches the remote one itself, off the startup path.
+
+    Returns:
+        MetricSnapshot: Values to swap into the registry
+    """
+    configs = collecting_configs()
+    if not configs:
+        # Never apply or store an empty snapshot in place of the last good one
+        raise RuntimeError("No config loaded yet, nothing to collect")
+    return asyncio.run(build_metrics_async(configs))
+
+
+def collecting_configs():
+    """The configs for the collection about to start.  Read from CONFIG_SOURCE, which a reload swaps
+    before config_changed runs, so a reload racing this one is never missed.
+
+    Returns:
+        list: Configurations, empty when there is none yet
+    """
+    if not CONFIG_SOURCE.ready.is_set() and CONFIG_SOURCE.remote:
+        reload_config()
+    with COLLECTING_LOCK:
+        configs = COLLECTING['configs'] = CONFIG_SOURCE.configs
+        # A reload that asked for a refresh before this point is covered by this collection
+        refresh_requested.clear()
+        if configs and configs is not CONFIG_MAPS:
+            use_configs(configs)
+        if configs:
+            load_store()
+    return configs
+
+
+def save_store(snapshot):
+    store.save(CONFIG_MAP, snapshot, ISSUE_STORE, LABEL_EVENT_CACHE, ITERATION_HISTORY)
+
+
+def load_store():
+    """Serve the snapshot from the previous run, if there is one, until the first refresh lands.  Only
+    once, before the first collection starts"""
+    if COLLECTING['store_loaded']:
+        return
+    COLLECTING['store_loaded'] = True
+    try:
+        snapshot = store.load(CONFIG_MAP, MetricSnapshot(), SNAPSHOT_GAUGES, SNAPSHOT_INFOS, ISSUE_STORE, LABEL_EVENT_CACHE, ITERATION_HISTORY)
+    except Exception:
+        logger.exception("Could not load the store, starting cold")
+        return
+    if snapshot:
+        apply_snapshot(snapshot, SNAPSHOT_GAUGES, SNAPSHOT_INFOS)
+        REFRESH_STATE['last_success'] = snapshot.created
+
+
+def issue_metrics(CONFIG_MAP, snapshot, gl_issues, retroName):
+    """Aggregate an iteration's issues and record its series, one team after the other
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        snapshot (MetricSnapshot): Snapshot to add the series to
+        gl_issues (list): Issues in the iteration
+        retroName (str): Iteration name
+    """
+    aggregated = aggregate_issues(gl_issues,CONFIG_MAP)
+    index = LabelIndex(gl_issues)
+    eng_done = {}
+    if CONFIG_MAP['issue_activity'] == 1:
+        for team in CONFIG_MAP['teams']:
+            eng_done[team] = run_team_issue_activity(team,gl_issues,CONFIG_MAP,index)
+    set_issue_metrics(CONFIG_MAP, snapshot, gl_issues, retroName, aggregated, eng_done)
+
+
+def issue_metrics_from_store(CONFIG_MAP, snapshot):
+    """Work out a config's iteration series from the issue store and the label event cache, without
+    asking GitLab for the issues again
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        snapshot (MetricSnapshot): Snapshot to add the series to
+    """
+    entry = ISSUE_STORE[(CONFIG_MAP['parent_group'], CONFIG_MAP['team_label'], False)]
+    issue_metrics(CONFIG_MAP, snapshot, list(entry['issues'].values()), entry['iteration'])
+
+
+def issue_series(CONFIG_MAP, issue, retroName, events):
+    """Work out what a single issue adds to its config's iteration series.  Every one of them is a sum
+    over the iteration issues, so the series of an iteration less one issue's are the series without it.
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        issue (dict): Issue in the iteration
+        retroName (str): Iteration name
+        events (list): The issue's label events, see retro.get_label_events, only read with issue_activity
+
+    Returns:
+        MetricSnapshot: The issue's series
+    """
+    snapshot = MetricSnapshot()
+    eng_done = {}
+    if CONFIG_MAP['issue_activity'] == 1:
+        for team in CONFIG_MAP['teams']:
+            eng_done[team] = Counter()
+            if CONFIG_MAP[team] in issue['labels'] and CONFIG_MAP['team_label'] in issue['labels']:
+                count_eng_done(CONFIG_MAP, events, eng_done[team])
+    set_issue_metrics(CONFIG_MAP, snapshot, [issue], retroName, aggregate_issues([issue], CONFIG_MAP), eng_done)
+    return snapshot
+
+
+def closed_iteration_metrics(CONFIG_MAP, retroName, snapshot):
+    """Work out the iteration series of a closed iteration.  Its issues are fetched for this alone and
+    not kept in the issue store, the series are cached in history.ITERATION_HISTORY instead.
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        retroName (str): Iteration name
+        snapshot (MetricSnapshot): Snapshot to add the series to
+    """
+    issue_metrics(CONFIG_MAP, snapshot, fetch_issues(CONFIG_MAP,CONFIG_MAP['team_label'],retroName), retroName)
+
+
+def handle_issue_webhook(payload):
+    """Apply an issue webhook to the issue store and the series of the configs holding the issue
+
+    Args:
+        payload (dict): Webhook body
+
+    Returns:
+        str: applied or ignored
+    """
+    WEBHOOK_STATS['received'] += 1
+    if payload.get('object_kind') != "issue" or not isinstance(payload.get('object_attributes'), dict):
+        WEBHOOK_STATS['ignored'] += 1
+        return "ignored"
+    with WEBHOOK_LOCK:
+        issue_id = payload['object_attributes']['id']
+        # The label events the applied series were worked out from, before the webhook's are added
+        before = LABEL_EVENT_CACHE.get(issue_id)
+        changes = apply_issue_event(payload, ISSUE_STORE, LABEL_EVENT_CACHE)
+        affected = [config for config in CONFIG_MAPS if (config['parent_group'], config['team_label'], False) in changes]
+        if not affected:
+            WEBHOOK_STATS['ignored'] += 1
+            return "ignored"
+        after = LABEL_EVENT_CACHE.get(issue_id)
+        delta = MetricSnapshot()
+        unknown = False
+        for config in affected:
+            key = (config['parent_group'], config['team_label'], False)
+            (old, new) = changes[key]
+            retroName = ISSUE_STORE[key]['iteration']
+            if config['issue_activity'] == 1 and (before is None or before[0] != old['updated_at']):
+                # Which label events the applied series counted is not known
+                unknown = True
+                continue
+            events = before[1] if before else []
+            delta.add(issue_series(config, old, retroName, events), -1)
+            if new is not None:
+                delta.add(issue_series(config, new, retroName, after[1] if after else []))
+        apply_delta(delta)
+    if unknown:
+        # Leave that config's series to a refresh in the background.  Asking GitLab for the label events
+        # here would hold the webhook past GitLab's timeout, and GitLab would send it again.
+        request_refresh()
+    WEBHOOK_STATS['applied'] += 1
+    logger.info("Applied webhook for issue {}".format(payload['object_attributes'].get('iid')))
+    return "applied"
+
+
+@app.post("/webhooks/gitlab")
+async def gitlab_webhook(request: Request):
+    if not verify_token(project['WEBHOOK_SECRET'], request.headers.get("X-Gitlab-Token")):
+        WEBHOOK_STATS['rejected'] += 1
+        return JSONResponse({"message": "invalid or missing X-Gitlab-Token"}, status_code=401)
+    try:
+        payload = await request.json()
+    except ValueError:
+        return JSONResponse({"message": "body is not JSON"}, status_code=400)
+    if not isinstance(payload, dict):
+        return JSONResponse({"message": "body is not a JSON object"}, status_code=400)
+    if LEADER.enabled and not LEADER.is_leader:
+        await in_thread(LEADER.forward_webhook, payload)
+        return {"status": "forwarded"}
+    return {"status": await in_thread(handle_issue_webhook, payload)}
+
+
+@app.get("/ready")
+async def ready():
+    LEADER.sync()
+    if REFRESH_STATE['ready_after'] is None:
+        return JSONResponse({"status": "starting", "config": CONFIG_STATE['source']}, status_code=503)
+    return {"status": "ready", "ready_after": REFRESH_STATE['ready_after'], "config": CONFIG_STATE['source']}
+
+
+def config_changed(configs):
+    """Rebuild from a reloaded config and refresh straight away"""
+    use_configs(configs)
+    with COLLECTING_LOCK:
+        if COLLECTING['configs'] is not configs:
+            request_refresh()
+
+
+def lead():
+    """Start everything that talks to GitLab or writes the store"""
+    if CONFIG_SOURCE.ready.is_set():
+        load_store()
+    if CONFIG_SOURCE.remote:
+        CONFIG_SOURCE.watch(config_reload_interval, config_changed)
+    elif not CONFIG_SOURCE.ready.is_set():
+        logger.error("No config: set CONFIG_PROJECT_ID and CONFIG_FILENAME, or CONFIG_LOCAL")
+    start_refresh_thread(build_metrics, SNAPSHOT_GAUGES, SNAPSHOT_INFOS, refresh_interval, save_store)
+
+
+@app.on_event("startup")
+def start_collector():
+    if LEADER.enabled:
+        LEADER.start(lead, handle_issue_webhook)
+    else:
+        lead()
+
+
+app.add_route("/metrics", LEADER.metrics_response)
@@ -0,0 +1,207 @@
+import time
+import threading
+import logging
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import gitlab_client
+from scheduler import PRIORITY_HIGH, PRIORITY_BULK
+
+logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(format=logFormatter, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pipelines in these states can still change without the project showing any activity
+UNFINISHED_PIPELINES = {"created", "waiting_for_resource", "preparing", "pending", "running", "scheduled", "manual"}
+OPEN_VULNERABILITIES = {"detected", "confirmed"}
+
+# (project id, vuln_status, pipeline_status) -> {"group", "last_activity_at", "fetched", "vulns": [(scanner, severity)],
+# "pipeline": status or None}.  What an entry holds depends on the flags, configs with other flags keep their own.
+PROJECT_CACHE = {}
+_cache_lock = threading.Lock()
+PROJECT_STATS = {
+    "fetched": 0,
+    "skipped": 0,
+    "failed": 0
+}
+
+
+def get_paged(CONFIG_MAP, url, priority, shared=False):
+    """Every page of a paginated list endpoint
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        url (str): Full url, without page and per_page
+        priority (int): Scheduler priority
+        shared (bool, optional): See gitlab_client.get
+
+    Returns:
+        list: Items of every page
+    """
+    items = []
+    page = 1
+    separator = "&" if "?" in url else "?"
+    while True:
+        response = gitlab_client.get(
+            "{}{}per_page=100&page={}".format(url, separator, page),
+            headers=CONFIG_MAP['GITLAB_HEADERS'],
+            priority=priority,
+            shared=shared
+        )
+        response.raise_for_status()
+        items.extend(response.json())
+        if page >= int(response.headers.get('X-Total-Pages') or 1):
+            return items
+        page += 1
+
+
+def projects_group(CONFIG_MAP):
+    return str(CONFIG_MAP.get('projects_group', CONFIG_MAP['parent_group']))
+
+
+def get_group_projects(CONFIG_MAP):
+    """Projects of projects_group (defaults to parent_group) and its subgroups, archived ones left out
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+
+    Returns:
+        list: Projects (simple representation)
+    """
+    group = projects_group(CONFIG_MAP)
+    return get_paged(
+        CONFIG_MAP,
+        CONFIG_MAP['GITLAB_URL'] + "groups/{}/projects?include_subgroups=true&archived=false&simple=true".format(group),
+        PRIORITY_HIGH,
+        shared=True
+    )
+
+
+def fetch_project(CONFIG_MAP, project):
+    """Open vulnerabilities and the latest default branch pipeline of a project
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        project (dict): Project as listed by get_group_projects
+
+    Returns:
+        dict: Cache entry for the project
+    """
+    entry = {
+        "group": projects_group(CONFIG_MAP),
+        "last_activity_at": project.get('last_activity_at'),
+        "fetched": time.time(),
+        "vulns": [],
+        "pipeline": None
+    }
+    if CONFIG_MAP['vuln_status'] == 1:
+        vulnerabilities = get_paged(CONFIG_MAP, CONFIG_MAP['GITLAB_URL'] + "projects/{}/vulnerabilities".format(project['id']), PRIORITY_BULK)
+        entry['vulns'] = [(vuln['report_type'], vuln['severity']) for vuln in vulnerabilities if vuln.get('state') in OPEN_VULNERABILITIES]
+    if CONFIG_MAP['pipeline_status'] == 1 and project.get('default_branch'):
+        response = gitlab_client.get(
+            CONFIG_MAP['GITLAB_URL'] + "projects/{}/pipelines?ref={}&per_page=1".format(project['id'], quote(project['default_branch'], safe="")),
+            headers=CONFIG_MAP['GITLAB_HEADERS'],
+            priority=PRIORITY_BULK
+        )
+        # CI turned off answers 403 with an error body
+        response.raise_for_status()
+        pipelines = response.json()
+        entry['pipeline'] = pipelines[0]['status'] if isinstance(pipelines, list) and pipelines else None
+    return entry
+
+
+def project_entry(CONFIG_MAP, project):
+    """Cached entry for a project, fetched again only when the project shows activity since the last
+    pass, its pipeline was still running, or the entry is older than project_status_max_age seconds
+    (defaults to 3600) to catch scheduled scans
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        project (dict): Project as listed by get_group_projects
+
+    Returns:
+        dict: Cache entry for the project, the previous one when the fetch fails, None without one
+    """
+    key = (project['id'], CONFIG_MAP['vuln_status'], CONFIG_MAP['pipeline_status'])
+    with _cache_lock:
+        cached = PROJECT_CACHE.get(key)
+    if (
+        cached is not None
+        and cached['last_activity_at'] == project.get('last_activity_at')
+        and cached['pipeline'] not in UNFINISHED_PIPELINES
+        and time.time() - cached['fetched'] < int(CONFIG_MAP.get('project_status_max_age', 3600))
+    ):
+        PROJECT_STATS['skipped'] += 1
+        return cached
+    try:
+        entry = fetch_project(CONFIG_MAP, project)
+    except Exception:
+        # e.g. no vulnerability report below Ultimate, one project must not fail the refresh
+        PROJECT_STATS['failed'] += 1
+        logger.exception("Could not fetch {}, {}".format(
+            project.get('path_with_namespace', project['id']), "keeping its last status" if cached else "skipping it"))
+        return cached
+    with _cache_lock:
+        PROJECT_CACHE[key] = entry
+    PROJECT_STATS['fetched'] += 1
+    return entry
+
+
+def collect_project_status(CONFIG_MAP):
+    """Vulnerability counts and pipeline status across the group's projects.  Configs sharing the group
+    during a refresh share one pass, see collect_project_status_once
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+
+    Returns:
+        dict:
+            vuln_sev (Counter): Open vulnerabilities by severity
+            vuln_scanner (Counter): Open vulnerabilities by scanner
+            vuln_details (dict): Scanner -> Counter of open vulnerabilities by severity
+            pipeline_status (Counter): Projects by status of their latest default branch pipeline
+            pipeline_projects (dict): Project path -> status of its latest default branch pipeline
+    """
+    key = ("project_status", CONFIG_MAP['GITLAB_URL'], projects_group(CONFIG_MAP), CONFIG_MAP['vuln_status'], CONFIG_MAP['pipeline_status'])
+    return gitlab_client.SHARED.do(key, lambda: collect_project_status_once(CONFIG_MAP))
+
+
+def collect_project_status_once(CONFIG_MAP):
+    """One pass over the group's projects, project_concurrency (defaults to 8) at a time.  GitLab
+    requests are still capped by http_max_in_flight.  See collect_project_status
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+
+    Returns:
+        dict: See collect_project_status
+    """
+    projects = get_group_projects(CONFIG_MAP)
+    workers = max(1, min(int(CONFIG_MAP.get('project_concurrency', 8)), len(projects) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        entries = list(pool.map(lambda project: project_entry(CONFIG_MAP, project), projects))
+
+    status = {
+        "vuln_sev": Counter(),
+        "vuln_scanner": Counter(),
+        "vuln_details": defaultdict(Counter),
+        "pipeline_status": Counter(),
+        "pipeline_projects": {}
+    }
+    for (project, entry) in zip(projects, entries):
+        if entry is None:
+            continue
+        for (scanner, severity) in entry['vulns']:
+            status['vuln_sev'][severity] += 1
+            status['vuln_scanner'][scanner] += 1
+            status['vuln_details'][scanner][severity] += 1
+        if entry['pipeline']:
+            status['pipeline_status'][entry['pipeline']] += 1
+            status['pipeline_projects'][project['path_with_namespace']] = entry['pipeline']
+    # Projects that left the group are not needed again
+    listed = set(project['id'] for project in projects)
+    with _cache_lock:
+        for (key, entry) in list(PROJECT_CACHE.items()):
+            if entry['group'] == projects_group(CONFIG_MAP) and key[0] not in listed:
+                del PROJECT_CACHE[key]
+    return status
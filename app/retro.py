@@ -1,9 +1,18 @@
 
 from fastapi import responses
-import requests
+import gitlab_client
+import gitlab_graphql
+from cache import LRUCache, SingleFlight
+from labels import get_classifier
+from issues import stream_issues
+from scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_BULK
+from instrumentation import stage, ISSUE_PAGES
 import datetime
+import time
 import re
 from collections import Counter
+from requests.structures import CaseInsensitiveDict
+from concurrent.futures import ThreadPoolExecutor
 import os
 import logging
 
@@ -11,6 +20,19 @@ logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
 logging.basicConfig(format=logFormatter, level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# issue id -> (updated_at, label events)
+LABEL_EVENT_CACHE = LRUCache(5000)
+# Teams and configs whose issues overlap ask for the same label events at the same time, only one goes out
+LABEL_EVENT_FETCHES = SingleFlight()
+
+# (group, labels, is backlog) -> {"iteration", "issues": {id: issue}, "last_sync", "last_full"}
+ISSUE_STORE = {}
+SYNC_STATS = {
+    "full": 0,
+    "incremental": 0,
+    "fetched": 0
+}
+
 
 def get_all_iterations(CONFIG_MAP):
     """Get the current iteration name
@@ -22,10 +44,11 @@ def get_all_iterations(CONFIG_MAP):
         str: Iteration name
     """
     gl_iterations = []
-    gl_iterations = requests.get(
+    gl_iterations = gitlab_client.get(
         CONFIG_MAP['GITLAB_URL'] + "groups/{}/iterations?state=current".format(CONFIG_MAP['iteration_group']),
         headers=CONFIG_MAP['GITLAB_HEADERS'],
-        verify=True
+        priority=PRIORITY_HIGH,
+        shared=True
     ).json()
 
     current_iteration = ""
@@ -43,6 +66,33 @@ def get_all_iterations(CONFIG_MAP):
     return current_iteration
 
 
+def get_closed_iterations(CONFIG_MAP,count):
+    """The most recently finished iterations
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        count (int): How many to return
+
+    Returns:
+        list: Iterations (id, title, due_date), latest first
+    """
+    closed = []
+    page = 1
+    while True:
+        response = gitlab_client.get(
+            CONFIG_MAP['GITLAB_URL'] + "groups/{}/iterations?state=closed&per_page=100&page={}".format(CONFIG_MAP['iteration_group'],page),
+            headers=CONFIG_MAP['GITLAB_HEADERS'],
+            priority=PRIORITY_HIGH,
+            shared=True
+        )
+        closed.extend(response.json())
+        if page >= int(response.headers.get('X-Total-Pages', 1)):
+            break
+        page += 1
+    closed.sort(key=lambda iteration: iteration['due_date'], reverse=True)
+    return [{"id": iteration['id'], "title": iteration['title'], "due_date": iteration['due_date']} for iteration in closed[:count]]
+
+
 def iteration_summarize_status(issues,CONFIG_MAP):
     """Run iteration based metrics
 
@@ -58,25 +108,27 @@ def iteration_summarize_status(issues,CONFIG_MAP):
     label_tally = Counter()
     priority_tally = Counter()
     severity_tally = Counter()
+    classify = get_classifier(CONFIG_MAP).classify
    
     for issue in issues:
         for label in issue['labels']:
-            if re.search(CONFIG_MAP['dev_label_prefix'],label):
+            summary = classify(label).summary
+            if summary == "dev":
                 label_tally[label] += 1
-            elif re.search(CONFIG_MAP['qa_label_prefix'],label):
+            elif summary == "qa":
                 label_tally[label] += 1
-            elif re.search(CONFIG_MAP['priority_label_prefix'],label):
+            elif summary == "priority":
                 priority_tally[label] += 1
-            elif re.search(CONFIG_MAP['severity_label_prefix'],label):
+            elif summary == "severity":
                 severity_tally[label] += 1
     return (label_tally,priority_tally,severity_tally)
 
 def get_participants(CONFIG_MAP,iid,in_tally):
     p_tally = Counter()
-    gl_participants = requests.get(
+    gl_participants = gitlab_client.get(
         iid + '/participants',
         headers=CONFIG_MAP['GITLAB_HEADERS'],
-        verify=True
+        priority=PRIORITY_BULK
     ).json()
 
     if gl_participants:
@@ -119,13 +171,14 @@ def team_based_metrics(issues,CONFIG_MAP):
     epic_tally = Counter()
     milestone_tally = Counter()
     participant_tally = Counter()
-    timeestimate = 0
     count = 1
+    classify = get_classifier(CONFIG_MAP).classify
     for issue in issues:
         for users in issue['assignees']:
             user = users['name']
             weight = 0
-            #If isssue is closed don't count the weight
+            timeestimate = 0
+            #If isssue is closed don't count the weight or the estimate
             if issue['state'] == "opened":
                 if issue['weight'] is None:
                     weight = 0
@@ -144,20 +197,21 @@ def team_based_metrics(issues,CONFIG_MAP):
             timesestimate_tally[user] += timeestimate
             user_tally[user] += 1
         for label in issue['labels']:
-            if re.search(CONFIG_MAP['dev_label_prefix'],label):
+            category = classify(label).category
+            if category == "dev":
                 status_tally[label] += 1
                 if label == CONFIG_MAP['done_status_label']:
                     # participant_tally = get_participants(CONFIG_MAP,issue['_links']['self'],participant_tally)
                     for participants in issue['assignees']:
                         participant = participants['name']
                         participant_tally[participant] += 1
-            elif re.search(CONFIG_MAP['qa_label_prefix'],label):
+            elif category == "qa":
                 status_tally[label] += 1
-            elif re.search(CONFIG_MAP['issue_status_prefix'],label):
+            elif category == "issue":
                 category_tally[label] += 1
-            elif re.search(CONFIG_MAP['priority_label_prefix'],label):
+            elif category == "priority":
                 priority_tally[label] += 1
-            elif re.search(CONFIG_MAP['severity_label_prefix'],label):
+            elif category == "severity":
                 severity_tally[label] += 1
         if issue['milestone']:
             if issue['milestone']['title'] == "":
@@ -199,6 +253,7 @@ def iteration_based_metrics(issues,CONFIG_MAP):
     overall_timeestimate = 0
     epic_tally = Counter()
     milestone_tally = Counter()
+    classify = get_classifier(CONFIG_MAP).classify
     
     for issue in issues:
         if issue['weight'] is None:
@@ -221,7 +276,7 @@ def iteration_based_metrics(issues,CONFIG_MAP):
         overall_timeestimate += timeestimate
         #get a weight by label breakdown
         for label in issue['labels']:
-            if re.search(CONFIG_MAP['dev_label_prefix'],label):
+            if classify(label).category == "dev":
                 label_tally[label] += weight
                 timesestimate_tally[label] += timeestimate
                 timespent_tally[label] += timespent
@@ -239,7 +294,7 @@ def iteration_based_metrics(issues,CONFIG_MAP):
     return (overall_weight, label_tally,overall_timeestimate,overall_timespent,timesestimate_tally,timespent_tally,epic_tally,milestone_tally)
         
     
-def get_issues(CONFIG_MAP2,includes_labels,page=1,iteration="Current",exclude_labels=False,issue_state="all"):
+def get_issues(CONFIG_MAP2,includes_labels,page=1,iteration="Current",exclude_labels=False,issue_state="all",updated_after=None,priority=PRIORITY_NORMAL):
     """Find all the correct issues.  Handles pagination and includes/excludes
 
     Args:
@@ -249,9 +304,11 @@ def get_issues(CONFIG_MAP2,includes_labels,page=1,iteration="Current",exclude_la
         iteration(str): Name of the iteration
         exclude_labels (str, optional): labels to filter out. Defaults to False.
         issue_state (str, optional): Look for opened or closed issues?. Defaults to "opened".
+        updated_after (str, optional): Only issues updated after this ISO 8601 time. Defaults to None.
+        priority (int, optional): Request scheduler priority. Defaults to PRIORITY_NORMAL.
 
     Returns:
-        dict: issues gathered from this pull
+        Response: the page, with the body not read yet
     """
 
     gl_params = "groups/{}/issues?labels={}&per_page=100&page={}".format(CONFIG_MAP2['parent_group'],includes_labels,page,issue_state)
@@ -268,53 +325,177 @@ def get_issues(CONFIG_MAP2,includes_labels,page=1,iteration="Current",exclude_la
         gl_params = gl_params + '&not[labels]={}'.format(exclude_labels)
         # gl_params = "groups/{}/issues?labels={}&per_page=100&page={}&state={}&not[labels]={}&iteration_title={}".format(project_id,includes_labels,page,issue_state,exclude_labels,iteration)
 
-    response = requests.get(
+    if updated_after:
+        gl_params = gl_params + '&updated_after={}'.format(updated_after)
+
+    # Streamed, the body is decoded issue by issue with stream_issues
+    response = gitlab_client.get(
         CONFIG_MAP2['GITLAB_URL'] + gl_params,
         headers=CONFIG_MAP2['GITLAB_HEADERS'],
-        verify=True
+        priority=priority,
+        stream=True
     )
-    logger.debug("issues returned: {}".format(len(response.json())))
+    ISSUE_PAGES.inc()
     return response
 
+def get_issues_page(CONFIG_MAP2,includes_labels,page,iteration,updated_after=None,priority=PRIORITY_NORMAL,headers=None):
+    """Fetch a single page of issues, retrying it on its own if it fails
+
+    Args:
+        CONFIG_MAP2 (dict): Configuration
+        includes_labels (str): Labels to search for
+        page (int): Page to fetch
+        iteration (str): Name of the iteration
+        updated_after (str, optional): Only issues updated after this ISO 8601 time
+        priority (int, optional): Request scheduler priority. Defaults to PRIORITY_NORMAL.
+        headers (dict, optional): Filled with the response headers, e.g. for X-Total-Pages
+
+    Returns:
+        list: issues on the page, as compact Issues
+    """
+    retries = int(CONFIG_MAP2.get('page_retries', 3))
+    for attempt in range(1, retries + 1):
+        try:
+            response = get_issues(CONFIG_MAP2.copy(),includes_labels,page,iteration,updated_after=updated_after,priority=priority)
+            if not response.ok:
+                response.close()
+                response.raise_for_status()
+            issues = list(stream_issues(response))
+            if headers is not None:
+                headers.update(response.headers)
+            return issues
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logger.warning("Retrying page {} ({}/{}): {}".format(page,attempt,retries,e))
+            time.sleep(attempt)
+
 # def locate_issues(÷project_id,filter_labels,iteration):
-def locate_issues(lCONFIG_MAP,filter_labels,iteration):
-    """Function to get all of the issues
+def locate_issues(lCONFIG_MAP,filter_labels,iteration,updated_after=None):
+    """Function to get all of the issues.  The first page tells us how many pages there are,
+    the rest are fetched concurrently (page_concurrency in the config) and kept in page order.
 
     Args:
         lCONFIG_MAP (dict): Configuration
         filter_labels (str): Label to filter by
         iteration (str): Iteration name
+        updated_after (str, optional): Only issues updated after this ISO 8601 time
 
     Returns:
-        dict: Dictionary of issues
+        list: Issues, projected to compact Issues as each page arrives
     """
     #query issues for a project and then filter down by labels supplied
     gl_issues = []
 
-    response = get_issues(lCONFIG_MAP.copy(),filter_labels,1,iteration)
-    gl_issues.extend(response.json())
+    # The first page tells us how much work is left, let it jump the queue.  It is retried like the others.
+    headers = CaseInsensitiveDict()
+    gl_issues.extend(get_issues_page(lCONFIG_MAP,filter_labels,1,iteration,updated_after,priority=PRIORITY_HIGH,headers=headers))
 
     try:
-        response.headers['X-Page']
-        page = int(response.headers['X-Page'])
+        headers['X-Page']
+        page = int(headers['X-Page'])
         logger.debug("try page: {}".format(page))
     except:
-        page = int(response.headers['X-Total-Pages'])
+        page = int(headers['X-Total-Pages'])
         logger.debug("except page: {}".format(page))
        
-    totalpage = int(response.headers['X-Total-Pages'])
+    totalpage = int(headers['X-Total-Pages'])
 
     logger.debug("page: {}".format(page))  
     logger.debug("totalpage: {}".format(totalpage)) 
-    
-    while page != totalpage:
-        page += 1
-        response = get_issues(lCONFIG_MAP.copy(),filter_labels,page,iteration)
-        gl_issues.extend(response.json())
+
+    remaining = range(page + 1, totalpage + 1)
+    if remaining:
+        workers = min(int(lCONFIG_MAP.get('page_concurrency', 4)), len(remaining))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # map hands results back in page order regardless of which finishes first
+            for issues in pool.map(lambda p: get_issues_page(lCONFIG_MAP,filter_labels,p,iteration,updated_after), remaining):
+                gl_issues.extend(issues)
     
     return(gl_issues)
 
 
+def fetch_issues(CONFIG_MAP,filter_labels,iteration,updated_after=None):
+    """locate_issues over REST, or over GraphQL when issue_source is "graphql" in the config
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        filter_labels (str): Label to filter by
+        iteration (str): Iteration name, or "backlog"
+        updated_after (str, optional): Only issues updated after this ISO 8601 time
+
+    Returns:
+        list: Issues, as compact Issues
+    """
+    if CONFIG_MAP.get('issue_source', "rest") == "graphql":
+        LABEL_EVENT_CACHE.resize(int(CONFIG_MAP.get('label_event_cache_size', 5000)))
+        return gitlab_graphql.locate_issues(CONFIG_MAP,filter_labels,iteration,LABEL_EVENT_CACHE,updated_after)
+    return locate_issues(CONFIG_MAP,filter_labels,iteration,updated_after)
+
+
+def sync_issues(CONFIG_MAP,filter_labels,iteration):
+    """Sync the issues for a query, configs asking for the same group and labels during a refresh share
+    one sync.  See sync_issues_once
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        filter_labels (str): Label to filter by
+        iteration (str): Iteration name, or "backlog"
+
+    Returns:
+        list: Issues matching the query
+    """
+    key = ("sync", CONFIG_MAP['GITLAB_URL'], CONFIG_MAP['parent_group'], filter_labels, iteration)
+    return gitlab_client.SHARED.do(key, lambda: sync_issues_once(CONFIG_MAP,filter_labels,iteration))
+
+
+def sync_issues_once(CONFIG_MAP,filter_labels,iteration):
+    """Keep a local copy of the issues for a query up to date.  After the first full pull only issues
+    updated since the last sync are requested and merged in by id.  Every full_sync_interval seconds,
+    or when the iteration changes, the whole set is pulled again to drop deleted issues and issues
+    that moved out of the iteration.
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        filter_labels (str): Label to filter by
+        iteration (str): Iteration name, or "backlog"
+
+    Returns:
+        list: Issues matching the query
+    """
+    key = (CONFIG_MAP['parent_group'], filter_labels, iteration == "backlog")
+    # Overlap the window a little so issues updated while the last sync was running are not missed
+    sync_start = datetime.datetime.utcnow() - datetime.timedelta(seconds=60)
+    entry = ISSUE_STORE.get(key)
+
+    full_sync = (
+        CONFIG_MAP.get('incremental_sync', 1) != 1
+        or entry is None
+        or entry['iteration'] != iteration
+        or time.time() - entry['last_full'] >= int(CONFIG_MAP.get('full_sync_interval', 3600))
+    )
+
+    if full_sync:
+        fetched = fetch_issues(CONFIG_MAP,filter_labels,iteration)
+        entry = {
+            "iteration": iteration,
+            "issues": {issue['id']: issue for issue in fetched},
+            "last_full": time.time()
+        }
+        ISSUE_STORE[key] = entry
+    else:
+        fetched = fetch_issues(CONFIG_MAP,filter_labels,iteration,updated_after=entry['last_sync'])
+        for issue in fetched:
+            entry['issues'][issue['id']] = issue
+    entry['last_sync'] = sync_start.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    SYNC_STATS['full' if full_sync else 'incremental'] += 1
+    SYNC_STATS['fetched'] += len(fetched)
+    logger.info("{} sync for {} ({}): {} issues fetched, {} held".format(
+        "Full" if full_sync else "Incremental", filter_labels, iteration, len(fetched), len(entry['issues'])))
+    return list(entry['issues'].values())
+
+
 def get_group_issues(CONFIG_MAP):
     """Filter issues for a group
 
@@ -326,13 +507,67 @@ def get_group_issues(CONFIG_MAP):
         getRetro (str): Name of the iteration
     """
 
-    getRetro = get_all_iterations(CONFIG_MAP)
+    with stage("iterations"):
+        getRetro = get_all_iterations(CONFIG_MAP)
     logger.info("Current Iteration: {}".format(getRetro))
 
-    gl_issues = locate_issues(CONFIG_MAP,CONFIG_MAP['team_label'],getRetro)
+    with stage("issues"):
+        gl_issues = sync_issues(CONFIG_MAP,CONFIG_MAP['team_label'],getRetro)
 
     return (gl_issues, getRetro)
 
+def count_issues(CONFIG_MAP,includes_labels,issue_state="opened"):
+    """Count the group issues carrying every label without downloading them.  Asks for a single issue
+    and reads X-Total, falling back to the issues statistics endpoint when GitLab leaves X-Total out
+    (it does above 10,000 results).
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        includes_labels (str): Comma separated labels that must all be present
+        issue_state (str, optional): opened or closed. Defaults to "opened".
+
+    Returns:
+        int: Number of matching issues
+    """
+    response = gitlab_client.get(
+        CONFIG_MAP['GITLAB_URL'] + "groups/{}/issues?labels={}&state={}&per_page=1".format(CONFIG_MAP['parent_group'],includes_labels,issue_state),
+        headers=CONFIG_MAP['GITLAB_HEADERS'],
+        shared=True
+    )
+    response.raise_for_status()
+    if response.headers.get('X-Total'):
+        return int(response.headers['X-Total'])
+
+    statistics = gitlab_client.get(
+        CONFIG_MAP['GITLAB_URL'] + "groups/{}/issues_statistics?labels={}".format(CONFIG_MAP['parent_group'],includes_labels),
+        headers=CONFIG_MAP['GITLAB_HEADERS'],
+        shared=True
+    ).json()
+    return int(statistics['statistics']['counts'][issue_state])
+
+def get_backlog_counts(CONFIG_MAP):
+    """Count backlog issues for every team in CONFIG_MAP['teams'].  The label filtering is done by GitLab,
+    so only a count comes back per team no matter how large the backlog is.
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+
+    Returns:
+        Counter: Backlog issue count by team
+    """
+    team_labels = list(set(CONFIG_MAP[team] for team in CONFIG_MAP['teams']))
+    results = Counter()
+
+    def backlog_count(label):
+        return count_issues(CONFIG_MAP,",".join([CONFIG_MAP['team_label'],CONFIG_MAP['backlog_label'],label]))
+
+    workers = max(1, min(int(CONFIG_MAP.get('page_concurrency', 4)), len(team_labels)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (label,count) in zip(team_labels,pool.map(backlog_count,team_labels)):
+            teamextract = label.split(' ')[0].lower()
+            results[teamextract] += count
+    return results
+
 def get_issue_counts(CONFIG_MAP,gl_issues):
     """Get counts of issues in backlog and the iteration.  Runs for every team in CONFIG_MAP['teams']
 
@@ -365,27 +600,20 @@ def get_issue_counts(CONFIG_MAP,gl_issues):
                 results[teamextract]['iteration'] += 1
     
     # Now look at backlog
-    bl_all_issues = locate_issues(CONFIG_MAP,CONFIG_MAP['team_label'],"backlog")
-    bl_issues = []
-    for issue in bl_all_issues:
-        for label in issue['labels']:
-            if label == CONFIG_MAP['backlog_label']:
-                bl_issues.append(issue)
-    for issue in bl_issues:
-        for label in issue['labels']:
-            if label in team_labels:
-                teamextract = label.split(' ')[0].lower()
-                results[teamextract]['backlog'] += 1
+    backlog = get_backlog_counts(CONFIG_MAP)
+    for teamextract in +backlog:
+        results[teamextract]['backlog'] += backlog[teamextract]
 
     # return(fe,be,sfdc)
     return(results)
 
-def run_retro2(team,gl_issues,CONFIG_MAP):
+def run_retro2(team,gl_issues,CONFIG_MAP,index=None):
     """
 
     Args:
         team (str): Name of the team to run report for
         gl_issues (dict): List of issues to run through
+        index (LabelIndex, optional): Label index over gl_issues
 
     Returns:
         list: list of dicts that contain metric data
@@ -393,21 +621,27 @@ def run_retro2(team,gl_issues,CONFIG_MAP):
     today = datetime.date.today()
 
     # ## All issues gathered
-    gathered_issues = team_filter(team,gl_issues,CONFIG_MAP)
+    gathered_issues = team_filter(team,gl_issues,CONFIG_MAP,index)
 
     return team_based_metrics(gathered_issues,CONFIG_MAP)
 
-def team_filter(team,gl_issues,CONFIG_MAP):
+def team_filter(team,gl_issues,CONFIG_MAP,index=None):
     """Filter issues by team
 
     Args:
         team (str): Name of the team to filter for
         gl_issues (dict): Issues to interrogate
         CONFIG_MAP (dict): Configuration
+        index (LabelIndex, optional): Label index over gl_issues, avoids scanning the whole list
 
     Returns:
         dict: Filtered list of issues
     """
+    if index is not None:
+        gathered_issues = index.query([CONFIG_MAP[team],CONFIG_MAP['team_label']])
+        logger.info("Number of issues: {}".format(len(gathered_issues)))
+        return gathered_issues
+
     ## All issues gathered
     gathered_issues = []
     for lissue in gl_issues:
@@ -418,39 +652,83 @@ def team_filter(team,gl_issues,CONFIG_MAP):
     logger.info("Number of issues: {}".format(len(gathered_issues)))
     return gathered_issues
 
-def run_team_issue_activity(team,gl_issues,CONFIG_MAP):
+def get_label_events(CONFIG_MAP,issue):
+    """Label events for an issue.  Event history is append only, so events are cached per issue and
+    only fetched again once the issue's updated_at moves.
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        issue (dict): Issue to look up
+
+    Returns:
+        list: (label name, action, user name) for every event that still has a label
+    """
+    LABEL_EVENT_CACHE.resize(int(CONFIG_MAP.get('label_event_cache_size', 5000)))
+    cached = LABEL_EVENT_CACHE.get(issue['id'])
+    if cached and cached[0] == issue['updated_at']:
+        LABEL_EVENT_CACHE.record(True)
+        return cached[1]
+    LABEL_EVENT_CACHE.record(False)
+    with LABEL_EVENT_FETCHES.scope():
+        return LABEL_EVENT_FETCHES.do((issue['id'], issue['updated_at']), lambda: fetch_label_events(CONFIG_MAP, issue))
+
+
+def fetch_label_events(CONFIG_MAP, issue):
+    """Fetch an issue's label events into the label event cache, see get_label_events"""
+    label_events = gitlab_client.get(
+        issue['_links']['self'] + '/resource_label_events',
+        headers=CONFIG_MAP['GITLAB_HEADERS'],
+        priority=PRIORITY_BULK
+    ).json()
+
+    events = []
+    for labels in label_events:
+        if isinstance(labels['label'], type(None)):
+            continue
+        events.append((labels['label']['name'],labels['action'],labels['user']['name']))
+    LABEL_EVENT_CACHE.put(issue['id'],(issue['updated_at'],events))
+    return events
+
+def run_team_issue_activity(team,gl_issues,CONFIG_MAP,index=None):
     """Look at label activity to see who which users are finished with work and moved to QA.  Lookup each issue in the interation
 
     Args:
         team (str): Which team to run against
         gl_issues (dict): Issues to interrogate
         CONFIG_MAP (dict): Configruation
+        index (LabelIndex, optional): Label index over gl_issues
 
     Returns:
         dict: count of tickets finished by user
     """
     logger.info("Runing Team Issue Activity")
-    gathered_issues = team_filter(team,gl_issues,CONFIG_MAP)
+    gathered_issues = team_filter(team,gl_issues,CONFIG_MAP,index)
 
 
     engComplete = Counter()
-    for issue in gathered_issues:
-        label_events = requests.get(
-            issue['_links']['self'] + '/resource_label_events',
-            headers=CONFIG_MAP['GITLAB_HEADERS'],
-            verify=True
-        ).json()
-        
-        for labels in label_events:
-            if isinstance(labels['label'], type(None)):
-                continue
-            else:
-                if labels['label']['name'] == CONFIG_MAP['eng_done_status'] and labels['action'] == "add":
-                    username = labels['user']['name']
-                    engComplete[username] += 1
+    workers = max(1, int(CONFIG_MAP.get('label_event_concurrency', 8)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for events in pool.map(lambda issue: get_label_events(CONFIG_MAP,issue), gathered_issues):
+            count_eng_done(CONFIG_MAP,events,engComplete)
     logger.info("Finished processing run_team_issue_activity")
     return engComplete
 
+def count_eng_done(CONFIG_MAP,events,tally):
+    """Count the users who added eng_done_status to an issue
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        events (list): Label events of the issue, see get_label_events
+        tally (Counter): Counts by user to add to
+
+    Returns:
+        Counter: tally
+    """
+    for (label_name,action,username) in events:
+        if label_name == CONFIG_MAP['eng_done_status'] and action == "add":
+            tally[username] += 1
+    return tally
+
 def get_releases(CONFIG_MAP):
     """Get the latest release name from the project
 
@@ -461,10 +739,10 @@ def get_releases(CONFIG_MAP):
         str: Version of the latest release  
     """
 
-    releases = requests.get(
+    releases = gitlab_client.get(
         CONFIG_MAP['GITLAB_URL'] + "projects/{}/releases?&order_by=released_at&sort=desc".format(CONFIG_MAP['releases_project']),
         headers=CONFIG_MAP['GITLAB_HEADERS'],
-        verify=True
+        shared=True
     ).json()
     reldate = re.search('(\d+-\d+-\d+)',releases[0]['released_at']).group(1)
     rels = {
@@ -0,0 +1,133 @@
+import heapq
+import itertools
+import threading
+import time
+import email.utils
+import logging
+
+logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(format=logFormatter, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Lower goes first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header, either delta seconds or an HTTP date
+
+    Args:
+        value (str): Header value
+
+    Returns:
+        float: Seconds to wait, None if the header can't be read
+    """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class RequestScheduler:
+    """Hands out request slots in priority order and adapts to GitLab's rate limit headers.
+
+    Concurrency starts at max_in_flight.  A 429 pauses every request for Retry-After (or until
+    RateLimit-Reset) and halves concurrency.  When RateLimit-Remaining drops below low_water of
+    RateLimit-Limit, requests are spaced out so the remaining budget lasts until the reset and
+    concurrency is halved.  Otherwise concurrency grows back by one per response.
+    """
+
+    def __init__(self, max_in_flight, low_water=0.1):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.low_water = float(low_water)
+        self.limit = self.max_in_flight
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.next_start = 0.0
+        self.interval = 0.0
+        self.throttle_seconds = 0.0
+        self.throttled = 0
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+
+    @property
+    def queue_depth(self):
+        return len(self._waiting)
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        """Wait for a request slot.  Waiters are served by priority, then arrival
+
+        Args:
+            priority (int, optional): PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_BULK
+        """
+        with self._cond:
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            throttled = False
+            while True:
+                if self._waiting[0] == ticket and self.in_flight < self.limit:
+                    now = time.time()
+                    delay = max(self.paused_until, self.next_start) - now
+                    if delay <= 0:
+                        break
+                    throttled = True
+                    self._cond.wait(delay)
+                    self.throttle_seconds += time.time() - now
+                else:
+                    self._cond.wait()
+            heapq.heappop(self._waiting)
+            self.in_flight += 1
+            self.next_start = time.time() + self.interval
+            if throttled:
+                self.throttled += 1
+            self._cond.notify_all()
+
+    def release(self, response=None):
+        """Give a slot back and learn from the response headers
+
+        Args:
+            response (Response, optional): Response to the request that held the slot
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if response is not None:
+                self.observe(response)
+            self._cond.notify_all()
+
+    def observe(self, response):
+        """Adjust concurrency and pacing from a response.  Called with the lock held
+
+        Args:
+            response (Response): Response from GitLab
+        """
+        headers = response.headers
+        now = time.time()
+        reset = headers.get('RateLimit-Reset')
+        reset_in = max(0.0, float(reset) - now) if reset else None
+
+        if response.status_code == 429:
+            wait = retry_after_seconds(headers.get('Retry-After'))
+            if wait is None:
+                wait = reset_in if reset_in is not None else 1.0
+            self.paused_until = max(self.paused_until, now + wait)
+            self.limit = max(1, self.limit // 2)
+            logger.warning("Rate limited by GitLab, pausing {:.1f}s, concurrency {}".format(wait, self.limit))
+            return
+
+        remaining = headers.get('RateLimit-Remaining')
+        budget = headers.get('RateLimit-Limit')
+        if remaining is not None and budget and int(remaining) < self.low_water * int(budget):
+            self.interval = (reset_in or 0.0) / max(1, int(remaining))
+            self.limit = max(1, self.limit // 2)
+            return
+
+        self.interval = 0.0
+        if self.limit < self.max_in_flight:
+            self.limit += 1
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from issues import compact_issue
+
+logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(format=logFormatter, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bump whenever the layout of a table or of the JSON stored in it changes.  A file written
+# with another version is thrown away instead of being read.
+SCHEMA_VERSION = 3
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS issue_store (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS label_events (issue_id INTEGER PRIMARY KEY, position INTEGER, updated_at TEXT, events TEXT)",
+    "CREATE TABLE IF NOT EXISTS snapshot (id INTEGER PRIMARY KEY, created REAL, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS iteration_history (key TEXT PRIMARY KEY, value TEXT)"
+]
+
+
+def store_path(CONFIG_MAP):
+    """Path of the store, None when persistence is turned off"""
+    return CONFIG_MAP.get('store_path') or None
+
+
+def connect(path):
+    """Open the store, recreating it when it was written with a different schema version
+
+    Args:
+        path (str): SQLite file
+
+    Returns:
+        Connection: Open connection
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+    if row is None or int(row[0]) != SCHEMA_VERSION:
+        if row is not None:
+            logger.warning("Store schema {} does not match {}, starting empty".format(row[0], SCHEMA_VERSION))
+        for table in ("issue_store", "label_events", "snapshot", "iteration_history"):
+            conn.execute("DELETE FROM {}".format(table))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+        conn.commit()
+    return conn
+
+
+def snapshot_to_dict(snapshot):
+    return {
+        "gauges": {gauge._name: [[list(labels), value] for (labels, value) in series.items()] for (gauge, series) in snapshot.gauges.items()},
+        "infos": {info._name: [[list(labels), value] for (labels, value) in series.items()] for (info, series) in snapshot.infos.items()}
+    }
+
+
+def snapshot_from_dict(data, snapshot, gauges, infos):
+    """Fill a MetricSnapshot from its stored form, skipping metrics that no longer exist"""
+    by_name = {metric._name: metric for metric in gauges + infos}
+    for (name, series) in data['gauges'].items():
+        if name in by_name:
+            for (labels, value) in series:
+                snapshot.set(by_name[name], labels, value)
+    for (name, series) in data['infos'].items():
+        if name in by_name:
+            for (labels, value) in series:
+                snapshot.info(by_name[name], labels, value)
+    return snapshot
+
+
+def file_size(conn):
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def enforce_size_cap(conn, max_bytes):
+    """Drop the least recently used label events until the file fits under max_bytes, then the
+    issue store.  The snapshot and the iteration history are kept, the snapshot is what lets /metrics
+    serve straight after a restart and the history is small and costly to rebuild.
+
+    Args:
+        conn (Connection): Open connection
+        max_bytes (int): Size cap
+    """
+    if file_size(conn) <= max_bytes:
+        return
+    total = conn.execute("SELECT COUNT(*) FROM label_events").fetchone()[0]
+    while total and file_size(conn) > max_bytes:
+        drop = max(1, total // 4)
+        conn.execute("DELETE FROM label_events WHERE issue_id IN (SELECT issue_id FROM label_events ORDER BY position LIMIT ?)", (drop,))
+        conn.commit()
+        conn.execute("VACUUM")
+        total -= drop
+    if file_size(conn) > max_bytes:
+        conn.execute("DELETE FROM issue_store")
+        conn.commit()
+        conn.execute("VACUUM")
+    logger.warning("Store trimmed to {} bytes".format(file_size(conn)))
+
+
+def save(CONFIG_MAP, snapshot, issue_store, label_event_cache, iteration_history):
+    """Write the issue store, label event cache, closed iteration history and the last snapshot to disk
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        snapshot (MetricSnapshot): Last applied snapshot
+        issue_store (dict): retro.ISSUE_STORE
+        label_event_cache (LRUCache): retro.LABEL_EVENT_CACHE
+        iteration_history (dict): history.ITERATION_HISTORY
+    """
+    path = store_path(CONFIG_MAP)
+    if not path:
+        return
+    start = time.time()
+    conn = connect(path)
+    try:
+        conn.execute("DELETE FROM issue_store")
+        conn.executemany(
+            "INSERT INTO issue_store (key, value) VALUES (?, ?)",
+            [(json.dumps(list(key)), json.dumps(entry, default=lambda issue: issue.to_dict())) for (key, entry) in list(issue_store.items())]
+        )
+        conn.execute("DELETE FROM label_events")
+        conn.executemany(
+            "INSERT INTO label_events (issue_id, position, updated_at, events) VALUES (?, ?, ?, ?)",
+            [(issue_id, position, updated_at, json.dumps(events))
+             for (position, (issue_id, (updated_at, events))) in enumerate(label_event_cache.items())]
+        )
+        conn.execute("DELETE FROM iteration_history")
+        conn.executemany(
+            "INSERT INTO iteration_history (key, value) VALUES (?, ?)",
+            [(json.dumps(list(key)), json.dumps(entry)) for (key, entry) in list(iteration_history.items())]
+        )
+        conn.execute("INSERT OR REPLACE INTO snapshot (id, created, value) VALUES (1, ?, ?)",
+                     (snapshot.created, json.dumps(snapshot_to_dict(snapshot))))
+        conn.commit()
+        enforce_size_cap(conn, int(CONFIG_MAP.get('store_max_mb', 100)) * 1024 * 1024)
+    finally:
+        conn.close()
+    logger.info("Store saved in {:.2f}s".format(time.time() - start))
+
+
+def load(CONFIG_MAP, snapshot, gauges, infos, issue_store, label_event_cache, iteration_history):
+    """Read a previous run back in
+
+    Args:
+        CONFIG_MAP (dict): Configuration
+        snapshot (MetricSnapshot): Empty snapshot to fill
+        gauges (list): Every Gauge owned by the snapshot
+        infos (list): Every Info owned by the snapshot
+        issue_store (dict): retro.ISSUE_STORE to fill
+        label_event_cache (LRUCache): retro.LABEL_EVENT_CACHE to fill
+        iteration_history (dict): history.ITERATION_HISTORY to fill
+
+    Returns:
+        MetricSnapshot: The stored snapshot, None when there was nothing to load
+    """
+    path = store_path(CONFIG_MAP)
+    if not path or not os.path.exists(path):
+        return None
+    conn = connect(path)
+    try:
+        for (key, value) in conn.execute("SELECT key, value FROM issue_store"):
+            entry = json.loads(value)
+            # JSON turns the integer issue ids into strings
+            entry['issues'] = {int(issue_id): compact_issue(issue) for (issue_id, issue) in entry['issues'].items()}
+            issue_store[tuple(json.loads(key))] = entry
+        for (issue_id, updated_at, events) in conn.execute("SELECT issue_id, updated_at, events FROM label_events ORDER BY position"):
+            label_event_cache.put(issue_id, (updated_at, [tuple(event) for event in json.loads(events)]))
+        for (key, value) in conn.execute("SELECT key, value FROM iteration_history"):
+            iteration_history[tuple(json.loads(key))] = json.loads(value)
+        row = conn.execute("SELECT created, value FROM snapshot WHERE id = 1").fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    snapshot_from_dict(json.loads(row[1]), snapshot, gauges, infos)
+    snapshot.created = row[0]
+    logger.info("Loaded store: {} issue queries, {} label event entries, {} closed iterations".format(
+        len(issue_store), len(label_event_cache), len(iteration_history)))
+    return snapshot
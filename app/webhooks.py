@@ -0,0 +1,138 @@
+import hmac
+import logging
+from issues import compact_issue
+
+logFormatter = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(format=logFormatter, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WEBHOOK_STATS = {
+    "received": 0,
+    "applied": 0,
+    "ignored": 0,
+    "rejected": 0
+}
+
+
+def verify_token(secret, token):
+    """Check the X-Gitlab-Token header against the configured secret
+
+    Args:
+        secret (str): WEBHOOK_SECRET, webhooks are refused when it is not set
+        token (str): Header value sent by GitLab
+
+    Returns:
+        bool: True when the token matches
+    """
+    if not secret or token is None:
+        return False
+    return hmac.compare_digest(secret.encode(), token.encode())
+
+
+def normalize_time(value):
+    """Webhooks send "2021-02-03 04:05:06 UTC", the REST API "2021-02-03T04:05:06.789Z".  Both come back
+    as "2021-02-03T04:05:06", which compares correctly as a string.
+
+    Args:
+        value (str): Timestamp in either format
+
+    Returns:
+        str: Timestamp to the second
+    """
+    return (value or "").replace(" UTC", "").replace(" ", "T")[:19]
+
+
+def label_titles(labels):
+    return [label['title'] for label in labels or []]
+
+
+def issue_from_payload(payload, issue):
+    """Apply an issue webhook to the stored copy of the issue.  Webhooks carry no milestone or epic
+    titles, those are kept from the stored copy until the next poll.
+
+    Args:
+        payload (dict): Issue webhook body
+        issue (Issue): Issue as held in the issue store
+
+    Returns:
+        Issue: Updated copy of the issue
+    """
+    attributes = payload['object_attributes']
+    updated = dict(issue)
+    updated['labels'] = label_titles(payload.get('labels'))
+    updated['assignees'] = [{"name": user['name'], "username": user.get('username')} for user in payload.get('assignees') or []]
+    updated['state'] = attributes.get('state', issue['state'])
+    updated['weight'] = attributes.get('weight')
+    updated['time_stats'] = dict(
+        issue.get('time_stats') or {},
+        time_estimate=attributes.get('time_estimate'),
+        total_time_spent=attributes.get('total_time_spent')
+    )
+    updated['updated_at'] = normalize_time(attributes.get('updated_at')) + "Z"
+    return compact_issue(updated)
+
+
+def record_label_events(payload, issue_id, updated_at, label_event_cache):
+    """Append the label changes in a webhook to the issue's cached label events, the way GitLab would
+    record them, and move the entry to the issue's new updated_at.  Every label change comes with a
+    webhook, so an entry kept current this way needs no fetch.  Issues without a cache entry are left
+    for the next poll to fetch in full.
+
+    Args:
+        payload (dict): Issue webhook body
+        issue_id (int): Issue id
+        updated_at (str): New updated_at of the issue
+        label_event_cache (LRUCache): retro.LABEL_EVENT_CACHE
+    """
+    changes = (payload.get('changes') or {}).get('labels')
+    cached = label_event_cache.get(issue_id)
+    if cached is None:
+        return
+    events = list(cached[1])
+    if changes:
+        previous = label_titles(changes.get('previous'))
+        current = label_titles(changes.get('current'))
+        user = (payload.get('user') or {}).get('name')
+        events += [(label, "add", user) for label in current if label not in previous]
+        events += [(label, "remove", user) for label in previous if label not in current]
+    label_event_cache.put(issue_id, (updated_at, events))
+
+
+def apply_issue_event(payload, issue_store, label_event_cache):
+    """Update every issue store query holding the issue.  The issue leaves a query once it no longer
+    carries the query's labels.  Issues the store does not hold yet are picked up by the next poll, a
+    webhook does not say which iteration an issue is in by title.  A payload no newer than the stored
+    copy (a redelivery, or a change the last poll already synced) changes nothing, so its label changes
+    are not counted twice.
+
+    Args:
+        payload (dict): Issue webhook body
+        issue_store (dict): retro.ISSUE_STORE
+        label_event_cache (LRUCache): retro.LABEL_EVENT_CACHE
+
+    Returns:
+        dict: Issue store key -> (issue before, issue after or None when it left the query) for every
+            query that changed
+    """
+    issue_id = payload['object_attributes']['id']
+    sent_at = normalize_time(payload['object_attributes'].get('updated_at'))
+    changed = {}
+    updated = None
+    for (key, entry) in list(issue_store.items()):
+        issue = entry['issues'].get(issue_id)
+        if issue is None:
+            continue
+        if sent_at <= normalize_time(issue.get('updated_at')):
+            logger.info("Ignoring webhook for issue {}, the stored copy is as new".format(issue_id))
+            continue
+        filter_labels = key[1]
+        updated = issue_from_payload(payload, issue)
+        if all(label in updated['labels'] for label in filter_labels.split(",")):
+            entry['issues'][issue_id] = updated
+            changed[key] = (issue, updated)
+        else:
+            del entry['issues'][issue_id]
+            changed[key] = (issue, None)
+    if updated is not None:
+        record_label_events(payload, issue_id, updated['updated_at'], label_event_cache)
+    return changed
@@ -0,0 +1,113 @@
+"""Compare the per function issue scans with the single pass aggregation on a synthetic iteration.
+
+    python bench/bench_aggregate.py [issue count] [team count]
+"""
+import os
+import sys
+import json
+import time
+import random
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from retro import iteration_summarize_status, iteration_based_metrics, run_retro2
+from aggregate import aggregate_issues
+
+
+def load_config():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config.json")) as f:
+        return json.load(f)
+
+
+def add_teams(CONFIG_MAP, count):
+    """Pad the configured teams out to count, labels follow the "<Team> GS" convention get_issue_counts expects"""
+    n = 0
+    while len(CONFIG_MAP['teams']) < count:
+        n += 1
+        team = "team{}".format(n)
+        CONFIG_MAP[team] = "Team{} GS".format(n)
+        CONFIG_MAP['teams'].append(team)
+    return CONFIG_MAP
+
+
+def synthetic_issues(CONFIG_MAP, count, seed=1):
+    """Issues shaped like the GitLab group issues API with a spread of labels, users, milestones and epics"""
+    rnd = random.Random(seed)
+    team_labels = [CONFIG_MAP[team] for team in CONFIG_MAP['teams']]
+    status_labels = [CONFIG_MAP['dev_label_prefix'] + s for s in ("Doing", "Review", "Done")] + [CONFIG_MAP['done_status_label']]
+    status_labels += [CONFIG_MAP['qa_label_prefix'] + s for s in ("Ready", "Testing")]
+    other_labels = [CONFIG_MAP['issue_status_prefix'] + s for s in ("Bug", "Feature", "Chore")]
+    other_labels += [CONFIG_MAP['priority_label_prefix'] + str(p) for p in range(1, 5)]
+    other_labels += [CONFIG_MAP['severity_label_prefix'] + str(p) for p in range(1, 5)]
+    other_labels += ["area::{}".format(n) for n in range(40)] + [CONFIG_MAP['backlog_label']]
+    users = ["user {}".format(n) for n in range(60)]
+
+    issues = []
+    for n in range(count):
+        labels = [CONFIG_MAP['team_label']] if rnd.random() < 0.9 else []
+        labels += rnd.sample(team_labels, rnd.randint(0, min(3, len(team_labels))))
+        labels.append(rnd.choice(status_labels))
+        labels += rnd.sample(other_labels, rnd.randint(0, 5))
+        issues.append({
+            "id": n,
+            "labels": labels,
+            "assignees": [{"name": name} for name in rnd.sample(users, rnd.randint(0, 2))],
+            "state": rnd.choice(["opened", "opened", "closed"]),
+            "weight": rnd.choice([None, 0, 1, 2, 3, 5, 8]),
+            "time_stats": {
+                "time_estimate": rnd.choice([None, 0, 3600, 7200, 28800]),
+                "total_time_spent": rnd.choice([None, 0, 1800, 3600, 14400])
+            },
+            "milestone": rnd.choice([None, {"title": ""}, {"title": "M{}".format(rnd.randint(1, 5))}]),
+            "epic": rnd.choice([None, {"title": ""}, {"title": "Epic {}".format(rnd.randint(1, 30))}])
+        })
+    return issues
+
+
+def per_function(issues, CONFIG_MAP):
+    team_labels = [CONFIG_MAP[team] for team in CONFIG_MAP['teams']]
+    counts = Counter()
+    for issue in issues:
+        for label in issue['labels']:
+            if label in team_labels:
+                counts[label.split(' ')[0].lower()] += 1
+    return {
+        "summary": iteration_summarize_status(issues, CONFIG_MAP),
+        "iteration": iteration_based_metrics(issues, CONFIG_MAP),
+        "counts": counts,
+        "teams": {team: run_retro2(team, issues, CONFIG_MAP) for team in CONFIG_MAP['teams']}
+    }
+
+
+def plain(value):
+    """Counters compare missing keys as zero, turn them into dicts so zero valued series are compared too"""
+    if isinstance(value, dict):
+        return {key: plain(item) for (key, item) in value.items()}
+    if isinstance(value, (tuple, list)):
+        return [plain(item) for item in value]
+    return value
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - start, result)
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.INFO)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    CONFIG_MAP = add_teams(load_config(), int(sys.argv[2]) if len(sys.argv) > 2 else 2)
+    issues = synthetic_issues(CONFIG_MAP, count)
+
+    (old_time, old) = timed(per_function, issues, CONFIG_MAP)
+    (new_time, new) = timed(aggregate_issues, issues, CONFIG_MAP)
+
+    assert plain(old) == plain(new), "single pass aggregation does not match the per function scans"
+    print("issues: {}  teams: {}".format(count, len(CONFIG_MAP['teams'])))
+    print("per function scans: {:.3f}s".format(old_time))
+    print("single pass:        {:.3f}s".format(new_time))
+    print("speedup:            {:.1f}x".format(old_time / new_time))
@@ -0,0 +1,74 @@
+"""Memory held by a large set of issues, as decoded GitLab JSON and as compact Issues.
+
+    python bench/bench_issue_memory.py --issues 50000
+
+Pages of issues are rendered the way the fake GitLab serves them, then decoded page by page.  "raw" keeps
+every decoded dict like the collector used to, "compact" decodes each whole page and projects it to Issues,
+"streamed" decodes the page in socket sized chunks and projects each issue as soon as it is complete.
+Retained is what the issue list holds once every page is in, peak is the high water mark while decoding.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "app"))
+
+from fake_gitlab import FakeGitLab
+from issues import compact_issue, compact_issues, iter_json_array, CHUNK_SIZE
+
+
+def render_pages(fake, per_page=100):
+    issues = [fake.issue_json(issue) for issue in fake.issues]
+    return [json.dumps(issues[start:start + per_page]).encode() for start in range(0, len(issues), per_page)]
+
+
+def read_raw(page):
+    return json.loads(page)
+
+
+def read_compact(page):
+    return compact_issues(json.loads(page))
+
+
+def read_streamed(page):
+    chunks = (page[start:start + CHUNK_SIZE].decode() for start in range(0, len(page), CHUNK_SIZE))
+    return [compact_issue(raw) for raw in iter_json_array(chunks)]
+
+
+def measure(pages, read, trace=True):
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    held = []
+    for page in pages:
+        held.extend(read(page))
+    elapsed = time.perf_counter() - start
+    (retained, peak) = tracemalloc.get_traced_memory() if trace else (0, 0)
+    if trace:
+        tracemalloc.stop()
+    return {"issues": len(held), "seconds": round(elapsed, 3), "retained_bytes": retained, "peak_bytes": peak}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--issues", type=int, default=50000)
+    parser.add_argument("--labels", type=int, default=40)
+    parser.add_argument("--users", type=int, default=60)
+    args = parser.parse_args()
+
+    fake = FakeGitLab(args.issues, args.labels, users=args.users)
+    fake.base_url = "http://127.0.0.1/api/v4/"
+    pages = render_pages(fake)
+    del fake
+    print("{} issues in {} pages, {:.1f} MiB of JSON".format(args.issues, len(pages), sum(len(page) for page in pages) / 1024 / 1024))
+    for (name, read) in (("raw", read_raw), ("compact", read_compact), ("streamed", read_streamed)):
+        # Timed without tracemalloc, it slows allocation heavy code down unevenly
+        seconds = measure(pages, read, trace=False)['seconds']
+        result = measure(pages, read)
+        print("{:<9} retained {:>7.1f} MiB  peak {:>7.1f} MiB  {:.3f}s".format(
+            name, result['retained_bytes'] / 1024 / 1024, result['peak_bytes'] / 1024 / 1024, seconds))
@@ -0,0 +1,214 @@
+"""End to end refresh benchmark against the local fake GitLab.
+
+    python bench/bench_refresh.py --issues 20000 --teams 4 --latency 0.02 --output bench_results.json
+
+Reports wall time, API calls by endpoint, bytes served, peak memory and the main collector functions for
+every refresh.  The fake GitLab runs in its own process, so the memory is the exporter's alone: the peak
+resident size during the refresh (the high-water mark is reset before each one, Linux only) and how far it
+rose above the resident size at the start.  Functions report their calls and the wall time at least one
+call was running, calls overlapping on the worker threads are not added up.  --trace-memory adds the peak
+of Python allocations during each refresh, it slows the refresh down a lot so time it separately.  The
+first refresh is cold, later ones show what the caches and incremental sync save.  Results are written as
+JSON so runs can be compared.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import tracemalloc
+import functools
+import multiprocessing
+import logging
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "app"))
+
+from fake_gitlab import FakeGitLab, parse_args as fake_args
+
+# Functions timed on every refresh, as (module, attribute)
+TIMED = [
+    ("retro", "locate_issues"),
+    ("main", "aggregate_issues"),
+    ("main", "run_team_issue_activity")
+]
+
+
+class FunctionTimer:
+    """Wraps module level functions and counts calls and the wall time any call was running"""
+
+    def __init__(self):
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, module, name):
+        func = getattr(module, name, None)
+        if func is None:
+            return
+        key = "{}.{}".format(module.__name__, name)
+        self.totals[key] = {"calls": 0, "seconds": 0.0, "running": 0, "since": 0.0}
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            total = self.totals[key]
+            with self._lock:
+                total['calls'] += 1
+                if total['running'] == 0:
+                    total['since'] = time.perf_counter()
+                total['running'] += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    total['running'] -= 1
+                    if total['running'] == 0:
+                        total['seconds'] += time.perf_counter() - total['since']
+
+        setattr(module, name, timed)
+
+    def reset(self):
+        with self._lock:
+            for total in self.totals.values():
+                total['calls'] = 0
+                total['seconds'] = 0.0
+
+    def report(self):
+        with self._lock:
+            return {key: {"calls": total['calls'], "seconds": round(total['seconds'], 4)} for (key, total) in self.totals.items()}
+
+
+def memory_status():
+    """(resident, high-water mark) of this process in bytes, None off Linux"""
+    try:
+        with open("/proc/self/status") as f:
+            fields = dict(line.split(":", 1) for line in f)
+    except OSError:
+        return (None, None)
+    return tuple(int(fields[name].split()[0]) * 1024 for name in ("VmRSS", "VmHWM"))
+
+
+def reset_peak_memory():
+    """Start the high-water mark again from the current resident size
+
+    Returns:
+        bool: False where the kernel does not allow it
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def serve_fake(args, commands, results):
+    """Run the fake GitLab in its own process.  Answers each command with the calls and bytes served since
+    the last one, None stops it."""
+    fake = FakeGitLab(args.issues, args.labels, args.teams, args.users, args.latency, configs=args.configs, history=args.history, projects=args.projects)
+    server = fake.serve()
+    results.put(fake.base_url)
+    while commands.get() is not None:
+        results.put((dict(fake.calls), fake.bytes_sent))
+        fake.calls.clear()
+        fake.bytes_sent = 0
+    server.shutdown()
+
+
+def run(args):
+    context = multiprocessing.get_context("spawn")
+    (commands, answers) = (context.Queue(), context.Queue())
+    fake = context.Process(target=serve_fake, args=(args, commands, answers), daemon=True)
+    fake.start()
+
+    os.environ["GITLAB_URL"] = answers.get(timeout=120)
+    os.environ.setdefault("CONFIG_PROJECT_ID", "1")
+    os.environ.setdefault("CONFIG_FILENAME", "config.json")
+    os.environ.setdefault("CONFIG_BRANCH", "main")
+    os.environ.setdefault("GL_ACCESS_TOKEN", "bench")
+
+    import main
+    import retro
+    import collector
+
+    timer = FunctionTimer()
+    modules = {"main": main, "retro": retro}
+    for (module, name) in TIMED:
+        timer.wrap(modules[module], name)
+
+    results = {
+        "params": vars(args),
+        "refreshes": []
+    }
+    for n in range(args.refreshes):
+        # Count the calls served from here on
+        commands.put("stats")
+        answers.get(timeout=120)
+        timer.reset()
+        peak_tracked = reset_peak_memory()
+        (rss_before, _) = memory_status()
+        if args.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        collector.refresh_once(main.build_metrics, main.SNAPSHOT_GAUGES, main.SNAPSHOT_INFOS)
+        elapsed = time.perf_counter() - start
+        peak_python = None
+        if args.trace_memory:
+            (current, peak_python) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        (rss_after, peak) = memory_status()
+        commands.put("stats")
+        (calls, bytes_served) = answers.get(timeout=120)
+        results['refreshes'].append({
+            "refresh": n + 1,
+            "seconds": round(elapsed, 4),
+            "api_calls": sum(calls.values()),
+            "api_calls_by_endpoint": calls,
+            "bytes_served": bytes_served,
+            "rss_before_bytes": rss_before,
+            "rss_after_bytes": rss_after,
+            "peak_rss_bytes": peak if peak_tracked else None,
+            "peak_python_memory_bytes": peak_python,
+            "functions": timer.report()
+        })
+    commands.put(None)
+    fake.join(timeout=30)
+    return results
+
+
+def mib(value):
+    return "n/a" if value is None else "{:.1f} MiB".format(value / 1024 / 1024)
+
+
+def print_results(results):
+    for refresh in results['refreshes']:
+        memory = "peak rss {}".format(mib(refresh['peak_rss_bytes']))
+        if refresh['peak_rss_bytes'] is not None and refresh['rss_before_bytes'] is not None:
+            memory += " (+{})".format(mib(refresh['peak_rss_bytes'] - refresh['rss_before_bytes']))
+        if refresh['peak_python_memory_bytes'] is not None:
+            memory += "  peak python {}".format(mib(refresh['peak_python_memory_bytes']))
+        print("refresh {}: {:.3f}s  {} api calls  {:.1f} KiB served  {}".format(
+            refresh['refresh'], refresh['seconds'], refresh['api_calls'], refresh['bytes_served'] / 1024, memory))
+        for (endpoint, calls) in sorted(refresh['api_calls_by_endpoint'].items()):
+            print("    {:<24} {}".format(endpoint, calls))
+        for (func, total) in sorted(refresh['functions'].items()):
+            print("    {:<32} {:>5} calls {:>9.3f}s wall".format(func, total['calls'], total['seconds']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--refreshes", type=int, default=2, help="refreshes to run, the first one is cold")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--trace-memory", action="store_true", help="track peak Python allocations with tracemalloc")
+    (args, rest) = parser.parse_known_args()
+    fake = fake_args(rest)
+    for (key, value) in vars(fake).items():
+        setattr(args, key, value)
+
+    logging.disable(logging.INFO)
+    results = run(args)
+    print_results(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("results written to {}".format(args.output))
@@ -0,0 +1,121 @@
+"""Count GitLab API calls with several worker processes, the way gunicorn runs the exporter.
+
+    python bench/bench_workers.py --workers 4
+    python bench/bench_workers.py --workers 4 --no-shared
+
+Starts the local fake GitLab and the given number of worker processes, each importing the app and running
+its startup like a gunicorn worker.  Once every worker serves a snapshot it prints the API calls made, which
+worker leads and the snapshot ETag each worker serves.  With SHARED_DIR (the default here) the calls should
+match a single worker and every worker should serve the same ETag.  --failover then stops the leader and
+waits for another worker to take over.
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import multiprocessing
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_gitlab import FakeGitLab
+
+
+def worker(base_url, shared_dir, commands, results):
+    sys.path.insert(0, os.path.join(BENCH_DIR, "..", "app"))
+    os.environ["GITLAB_URL"] = base_url
+    os.environ["CONFIG_PROJECT_ID"] = "1"
+    os.environ["CONFIG_FILENAME"] = "config.json"
+    os.environ["CONFIG_BRANCH"] = "main"
+    os.environ["GL_ACCESS_TOKEN"] = "bench"
+    if shared_dir:
+        os.environ["SHARED_DIR"] = shared_dir
+    import logging
+    logging.disable(logging.INFO)
+    import main
+    from collector import REFRESH_STATE
+    from starlette.requests import Request
+
+    main.start_collector()
+    while True:
+        command = commands.get()
+        if command is None:
+            return
+        if command == "ready":
+            main.LEADER.sync()
+            answer = REFRESH_STATE['ready_after'] is not None
+        elif command == "leader":
+            answer = main.LEADER.is_leader or not main.LEADER.enabled
+        else:
+            response = main.LEADER.metrics_response(Request({"type": "http", "method": "GET", "path": "/metrics", "headers": []}))
+            answer = response.headers['etag']
+        results.put(answer)
+
+
+def ask(workers, command):
+    answers = []
+    for (process, commands, results) in workers:
+        commands.put(command)
+        answers.append(results.get(timeout=60))
+    return answers
+
+
+def wait_until(workers, command, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if all(ask(workers, command)):
+            return True
+        time.sleep(0.2)
+    return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--issues", type=int, default=2000)
+    parser.add_argument("--teams", type=int, default=2)
+    parser.add_argument("--no-shared", action="store_true", help="every worker collects, as without SHARED_DIR")
+    parser.add_argument("--failover", action="store_true", help="stop the leader and wait for a new one")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    fake = FakeGitLab(args.issues, 40, args.teams, 60)
+    server = fake.serve()
+    shared_dir = None if args.no_shared else tempfile.mkdtemp(prefix="gitlabkpis-")
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for _ in range(args.workers):
+        (commands, results) = (context.Queue(), context.Queue())
+        process = context.Process(target=worker, args=(fake.base_url, shared_dir, commands, results), daemon=True)
+        process.start()
+        workers.append((process, commands, results))
+
+    start = time.perf_counter()
+    if not wait_until(workers, "ready", args.timeout):
+        sys.exit("Workers not ready after {}s".format(args.timeout))
+    print("{} workers{}: ready in {:.2f}s, {} api calls".format(
+        args.workers, "" if shared_dir else " (no SHARED_DIR)", time.perf_counter() - start, sum(fake.calls.values())))
+    for (endpoint, calls) in sorted(fake.calls.items()):
+        print("    {:<24} {}".format(endpoint, calls))
+    leaders = ask(workers, "leader")
+    etags = ask(workers, "etag")
+    for ((process, commands, results), leading, etag) in zip(workers, leaders, etags):
+        print("    worker {:<8} {:<8} {}".format(process.pid, "leader" if leading else "follower", etag))
+    print("{} distinct snapshots served".format(len(set(etags))))
+
+    if args.failover and shared_dir:
+        leader = workers[leaders.index(True)]
+        leader[0].terminate()
+        leader[0].join()
+        workers.remove(leader)
+        start = time.perf_counter()
+        while not any(ask(workers, "leader")):
+            if time.perf_counter() - start > args.timeout:
+                sys.exit("No worker took over after {}s".format(args.timeout))
+            time.sleep(0.2)
+        print("Leader {} stopped, another worker took over in {:.2f}s".format(leader[0].pid, time.perf_counter() - start))
+
+    for (process, commands, results) in workers:
+        commands.put(None)
+    server.shutdown()
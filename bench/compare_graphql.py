@@ -0,0 +1,71 @@
+"""Check the GraphQL issue source against the REST one.
+
+    python bench/compare_graphql.py --issues 5000 --teams 4
+
+Starts the local fake GitLab and runs a cold refresh with issue_source "rest", then another cold refresh
+(empty issue store and label event cache) with issue_source "graphql".  Prints the time and API calls of
+each and every series whose value differs, and exits non zero when any does.
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "app"))
+
+from fake_gitlab import FakeGitLab
+from replay_webhooks import applied_series
+
+
+def cold_refresh(fake, main, retro, collector, source):
+    for CONFIG_MAP in main.CONFIG_MAPS:
+        CONFIG_MAP['issue_source'] = source
+    retro.ISSUE_STORE.clear()
+    size = retro.LABEL_EVENT_CACHE.maxsize
+    retro.LABEL_EVENT_CACHE.resize(0)
+    retro.LABEL_EVENT_CACHE.resize(size)
+    fake.calls.clear()
+    start = time.perf_counter()
+    collector.refresh_once(main.build_metrics, main.SNAPSHOT_GAUGES, main.SNAPSHOT_INFOS)
+    elapsed = time.perf_counter() - start
+    print("{}: {:.3f}s  {} api calls".format(source, elapsed, sum(fake.calls.values())))
+    for (endpoint, calls) in sorted(fake.calls.items()):
+        print("    {:<24} {}".format(endpoint, calls))
+    return applied_series(collector)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--issues", type=int, default=5000)
+    parser.add_argument("--labels", type=int, default=40)
+    parser.add_argument("--teams", type=int, default=2)
+    parser.add_argument("--users", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--configs", type=int, default=1)
+    args = parser.parse_args()
+
+    fake = FakeGitLab(args.issues, args.labels, args.teams, args.users, args.latency, configs=args.configs)
+    server = fake.serve()
+    os.environ["GITLAB_URL"] = fake.base_url
+    os.environ.setdefault("CONFIG_PROJECT_ID", "1")
+    os.environ.setdefault("CONFIG_FILENAME", "config.json")
+    os.environ.setdefault("CONFIG_BRANCH", "main")
+    os.environ.setdefault("GL_ACCESS_TOKEN", "bench")
+    logging.disable(logging.INFO)
+
+    import main
+    import retro
+    import collector
+
+    rest = cold_refresh(fake, main, retro, collector, "rest")
+    graphql = cold_refresh(fake, main, retro, collector, "graphql")
+    server.shutdown()
+
+    differences = [key for key in sorted(set(rest) | set(graphql), key=str) if rest.get(key) != graphql.get(key)]
+    for key in differences:
+        print("    {}{} rest {} graphql {}".format(key[0], list(key[1]), rest.get(key), graphql.get(key)))
+    print("{} series, {} differ".format(len(rest), len(differences)))
+    sys.exit(1 if differences else 0)
@@ -0,0 +1,385 @@
+"""Local stand-in for the parts of the GitLab API the exporter uses, serving synthetic data.
+
+    python bench/fake_gitlab.py --issues 5000 --port 8080
+
+Then point the exporter at it with GITLAB_URL=http://127.0.0.1:8080/api/v4/
+
+POST /api/graphql answers the two queries in app/gitlab_graphql.py from the same data.  It does not parse
+GraphQL, the query is picked by its operation name and only its variables are read.
+"""
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ITERATION = "Sprint 1"
+# Finished iterations, latest first.  Half of the issues outside the current iteration are spread over them.
+CLOSED_ITERATIONS = [
+    {"id": 10 + n, "title": "Past Sprint {}".format(n), "state": "closed",
+     "start_date": "2020-{:02d}-01".format(13 - 2 * n), "due_date": "2020-{:02d}-14".format(13 - 2 * n)}
+    for n in range(1, 7)
+]
+GROUP = "1000"
+PROJECT = "2000"
+SCANNERS = ["sast", "dependency_scanning", "container_scanning", "secret_detection"]
+SEVERITIES = ["critical", "high", "medium", "low", "info"]
+PIPELINE_STATUSES = ["success", "success", "success", "failed", "running", "canceled"]
+
+
+def fake_config(teams, team_label="Core", history=0, projects=0):
+    """Config file served from the repository files endpoint, shaped like config.json"""
+    config = {
+        "team_label": team_label,
+        "coredev_summary": team_label,
+        "parent_group": GROUP,
+        "iteration_group": GROUP,
+        "teams": [],
+        "releases_project": PROJECT,
+        "backlog_label": "Dev GS::Backlog",
+        "pipeline_status": 1 if projects else 0,
+        "vuln_status": 1 if projects else 0,
+        "release_status": 1,
+        "issue_activity": 1,
+        "eng_done_status": "QA::Ready",
+        "done_status_label": "Dev::Done",
+        "qa_label_prefix": "QA::",
+        "dev_label_prefix": "Dev::",
+        "issue_status_prefix": "Issue::",
+        "priority_label_prefix": "Priority::",
+        "severity_label_prefix": "Severity::",
+        "iteration_history": history
+    }
+    for n in range(1, teams + 1):
+        team = "team{}".format(n)
+        config[team] = "Team{} GS".format(n)
+        config['teams'].append(team)
+    return config
+
+
+class FakeGitLab:
+    """Synthetic group: issues spread over teams, statuses and users, with label event history"""
+
+    def __init__(self, issues=5000, labels=40, teams=2, users=60, latency=0.0, seed=1, configs=1, history=0, projects=0):
+        self.latency = latency
+        # Extra configs share the group, iterations and releases project but have their own group label
+        self.configs = [fake_config(teams, "Core" if n == 0 else "Core{}".format(n + 1), history, projects) for n in range(configs)]
+        self.config = self.configs[0]
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self.base_url = None
+        self.issues = []
+        self.events = {}
+        self.label_ids = {}
+        self._generate(issues, labels, users, random.Random(seed))
+        # Own random source, so the issues stay the same whatever the project count
+        self.projects = []
+        self._generate_projects(projects, random.Random(seed + 1))
+
+    def _generate(self, count, label_count, user_count, rnd):
+        config = self.config
+        team_labels = [config[team] for team in config['teams']]
+        status_labels = ["Dev::Doing", "Dev::Review", config['done_status_label'], "QA::Ready", "QA::Testing"]
+        other_labels = ["Issue::Bug", "Issue::Feature", "Issue::Chore"]
+        other_labels += ["Priority::{}".format(p) for p in range(1, 5)]
+        other_labels += ["Severity::{}".format(p) for p in range(1, 5)]
+        other_labels += ["area::{}".format(n) for n in range(label_count)]
+        users = [{"id": n, "name": "user {}".format(n), "username": "user{}".format(n)} for n in range(user_count)]
+        for title in [c['team_label'] for c in self.configs] + team_labels + status_labels + other_labels + [config['backlog_label']]:
+            self.label(title)
+
+        for n in range(1, count + 1):
+            in_iteration = rnd.random() < 0.4
+            group_labels = [c['team_label'] for c in self.configs]
+            labels = rnd.sample(group_labels, rnd.randint(1, len(group_labels)))
+            labels += rnd.sample(team_labels, rnd.randint(1, min(2, len(team_labels))))
+            labels.append(rnd.choice(status_labels))
+            labels += rnd.sample(other_labels, rnd.randint(0, 4))
+            if not in_iteration and rnd.random() < 0.7:
+                labels.append(config['backlog_label'])
+            assignees = rnd.sample(users, rnd.randint(0, 2))
+            self.issues.append({
+                "id": 100000 + n,
+                "iid": n,
+                "project_id": int(PROJECT),
+                "title": "Issue {}".format(n),
+                "description": "Synthetic issue {} ".format(n) * rnd.randint(1, 20),
+                "state": rnd.choice(["opened", "opened", "closed"]),
+                "created_at": "2021-01-01T00:00:00.000Z",
+                "updated_at": "2021-02-{:02d}T00:00:00.000Z".format(rnd.randint(1, 28)),
+                "labels": labels,
+                "assignees": assignees,
+                "author": rnd.choice(users),
+                "weight": rnd.choice([None, 1, 2, 3, 5, 8]),
+                "time_stats": {
+                    "time_estimate": rnd.choice([0, 3600, 7200, 28800]),
+                    "total_time_spent": rnd.choice([0, 1800, 3600, 14400]),
+                    "human_time_estimate": None,
+                    "human_total_time_spent": None
+                },
+                "milestone": rnd.choice([None, {"id": 1, "title": "M1"}, {"id": 2, "title": "M2"}]),
+                "epic": rnd.choice([None, {"id": 1, "title": "Epic {}".format(rnd.randint(1, 30))}]),
+                "iteration": {"title": ITERATION} if in_iteration else {"title": CLOSED_ITERATIONS[n % len(CLOSED_ITERATIONS)]['title']} if n % 2 else None,
+                "references": {"full": "group/project#{}".format(n)},
+                "web_url": "http://gitlab.example/group/project/-/issues/{}".format(n)
+            })
+            self.events[n] = [
+                {
+                    "id": n * 10 + e,
+                    "user": rnd.choice(users),
+                    "created_at": "2021-01-0{}T00:00:00.000Z".format(e + 1),
+                    "resource_type": "Issue",
+                    "resource_id": 100000 + n,
+                    "label": None if rnd.random() < 0.05 else self.label(rnd.choice(status_labels)),
+                    "action": rnd.choice(["add", "remove"])
+                }
+                for e in range(rnd.randint(0, 6))
+            ]
+
+    def _generate_projects(self, count, rnd):
+        for n in range(count):
+            self.projects.append({
+                "id": 3000 + n,
+                "path_with_namespace": "group/project{}".format(n),
+                "default_branch": "main",
+                "last_activity_at": "2021-01-01T00:00:00.000Z",
+                "vulnerabilities": [
+                    {"report_type": rnd.choice(SCANNERS), "severity": rnd.choice(SEVERITIES), "state": rnd.choice(["detected", "confirmed", "resolved"])}
+                    for _ in range(rnd.randint(0, 12))
+                ],
+                "pipeline": rnd.choice(PIPELINE_STATUSES)
+            })
+
+    def touch_projects(self, count):
+        """Mark the first count projects active, with a new pipeline, like a push would"""
+        with self._lock:
+            for project in self.projects[:count]:
+                project['last_activity_at'] = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+                project['pipeline'] = "success"
+
+    def project(self, project_id):
+        for project in self.projects:
+            if str(project['id']) == project_id:
+                return project
+        return None
+
+    def label(self, title):
+        """Label as events reference it, ids are stable per title"""
+        label_id = self.label_ids.setdefault(title, len(self.label_ids) + 1)
+        return {"id": label_id, "name": title}
+
+    def issue_json(self, issue):
+        issue = dict(issue)
+        issue['_links'] = {"self": "{}projects/{}/issues/{}".format(self.base_url, PROJECT, issue['iid'])}
+        return issue
+
+    def select_issues(self, query):
+        labels = [label for label in query.get('labels', [""])[0].split(",") if label]
+        not_labels = [label for label in query.get('not[labels]', [""])[0].split(",") if label]
+        state = query.get('state', ["all"])[0]
+        iteration = query.get('iteration_title', [None])[0]
+        updated_after = query.get('updated_after', [None])[0]
+        selected = []
+        for issue in self.issues:
+            if state != "all" and issue['state'] != state:
+                continue
+            if iteration and (issue['iteration'] is None or issue['iteration']['title'] != iteration):
+                continue
+            if updated_after and issue['updated_at'] <= updated_after:
+                continue
+            if any(label not in issue['labels'] for label in labels):
+                continue
+            if any(label in issue['labels'] for label in not_labels):
+                continue
+            selected.append(issue)
+        return selected
+
+    def issue_node(self, issue, with_events):
+        """An issue as the GroupIssues GraphQL query returns it"""
+        node = {
+            "id": "gid://gitlab/Issue/{}".format(issue['id']),
+            "iid": str(issue['iid']),
+            "projectId": issue['project_id'],
+            "state": issue['state'],
+            "updatedAt": issue['updated_at'].replace(".000Z", "Z"),
+            "weight": issue['weight'],
+            "timeEstimate": issue['time_stats']['time_estimate'],
+            "totalTimeSpent": issue['time_stats']['total_time_spent'],
+            "labels": {"nodes": [{"id": "gid://gitlab/GroupLabel/{}".format(self.label_ids[title]), "title": title} for title in issue['labels']]},
+            "assignees": {"nodes": [{"name": user['name'], "username": user['username']} for user in issue['assignees']]},
+            "milestone": {"title": issue['milestone']['title']} if issue['milestone'] else None,
+            "epic": {"title": issue['epic']['title']} if issue['epic'] else None,
+            "iteration": issue['iteration']
+        }
+        if with_events:
+            notes = []
+            if issue['iid'] % 3 == 0:
+                notes.append({"body": "changed the description", "author": issue['author'], "systemNoteMetadata": {"action": "description"}})
+            for event in self.events[issue['iid']]:
+                # A deleted label is still referenced by id, it just no longer resolves
+                label_id = event['label']['id'] if event['label'] else 900000 + event['id']
+                notes.append({
+                    "body": "{} ~{} label".format("added" if event['action'] == "add" else "removed", label_id),
+                    "author": {"name": event['user']['name']},
+                    "systemNoteMetadata": {"action": "label"}
+                })
+            node['notes'] = {"pageInfo": {"hasNextPage": False}, "nodes": notes}
+        return node
+
+    def graphql(self, request):
+        """Returns (endpoint name, status, body, headers) for a GraphQL request"""
+        variables = request.get('variables') or {}
+        start = int(variables.get('after') or 0)
+        if "query GroupLabels" in request.get('query', ""):
+            labels = [{"id": "gid://gitlab/GroupLabel/{}".format(label_id), "title": title} for (title, label_id) in self.label_ids.items()]
+            batch = labels[start:start + 100]
+            page_info = {"hasNextPage": start + 100 < len(labels), "endCursor": str(start + 100)}
+            return ("graphql", 200, {"data": {"group": {"labels": {"pageInfo": page_info, "nodes": batch}}}}, {})
+        if "query GroupIssues" in request.get('query', ""):
+            query = {"labels": [",".join(variables.get('labels') or [])], "state": [variables.get('state') or "all"]}
+            if variables.get('iteration'):
+                query['iteration_title'] = [variables['iteration']]
+            if variables.get('updatedAfter'):
+                query['updated_after'] = [variables['updatedAfter']]
+            selected = self.select_issues(query)
+            first = int(variables['first'])
+            batch = [self.issue_node(issue, variables.get('withEvents')) for issue in selected[start:start + first]]
+            page_info = {"hasNextPage": start + first < len(selected), "endCursor": str(start + first)}
+            return ("graphql", 200, {"data": {"group": {"issues": {"pageInfo": page_info, "nodes": batch}}}}, {})
+        return ("graphql", 200, {"errors": [{"message": "Unknown query"}]}, {})
+
+    def route(self, path, query):
+        """Returns (endpoint name, status, body, headers) for a request"""
+        if re.search(r"/groups/[^/]+$", path):
+            return ("group", 200, {"id": int(GROUP), "full_path": "group"}, {})
+        if re.search(r"/projects/[^/]+/repository/files/[^/]+/raw$", path):
+            return ("config", 200, self.config if len(self.configs) == 1 else self.configs, {})
+        if re.search(r"/groups/[^/]+/iterations$", path):
+            current = [{"id": 1, "title": ITERATION, "state": "current", "start_date": "2000-01-01", "due_date": "2999-12-31"}]
+            state = query.get('state', ["all"])[0]
+            iterations = {"current": current, "closed": CLOSED_ITERATIONS}.get(state, current + CLOSED_ITERATIONS)
+            return ("iterations", 200, iterations, {"X-Total-Pages": "1"})
+        if re.search(r"/groups/[^/]+/issues_statistics$", path):
+            selected = self.select_issues(query)
+            opened = sum(1 for issue in selected if issue['state'] == "opened")
+            return ("issues_statistics", 200, {"statistics": {"counts": {"all": len(selected), "opened": opened, "closed": len(selected) - opened}}}, {})
+        if re.search(r"/groups/[^/]+/issues$", path):
+            selected = self.select_issues(query)
+            per_page = int(query.get('per_page', ["20"])[0])
+            page = int(query.get('page', ["1"])[0])
+            pages = max(1, (len(selected) + per_page - 1) // per_page)
+            body = [self.issue_json(issue) for issue in selected[(page - 1) * per_page:page * per_page]]
+            headers = {"X-Page": str(page), "X-Total-Pages": str(pages), "X-Total": str(len(selected)), "X-Per-Page": str(per_page)}
+            return ("issues_count" if per_page == 1 else "issues", 200, body, headers)
+        if re.search(r"/groups/[^/]+/projects$", path):
+            per_page = int(query.get('per_page', ["20"])[0])
+            page = int(query.get('page', ["1"])[0])
+            pages = max(1, (len(self.projects) + per_page - 1) // per_page)
+            body = [
+                {key: project[key] for key in ("id", "path_with_namespace", "default_branch", "last_activity_at")}
+                for project in self.projects[(page - 1) * per_page:page * per_page]
+            ]
+            return ("projects", 200, body, {"X-Page": str(page), "X-Total-Pages": str(pages)})
+        match = re.search(r"/projects/([^/]+)/(vulnerabilities|pipelines)$", path)
+        if match and self.project(match.group(1)):
+            project = self.project(match.group(1))
+            if match.group(2) == "vulnerabilities":
+                return ("vulnerabilities", 200, project['vulnerabilities'], {"X-Total-Pages": "1"})
+            return ("pipelines", 200, [{"id": 1, "ref": "main", "status": project['pipeline']}], {})
+        match = re.search(r"/projects/[^/]+/issues/(\d+)/resource_label_events$", path)
+        if match:
+            return ("resource_label_events", 200, self.events.get(int(match.group(1)), []), {})
+        if re.search(r"/projects/[^/]+/releases$", path):
+            releases = [{"tag_name": "v1.{}".format(n), "released_at": "2021-0{}-01T00:00:00.000Z".format(9 - n)} for n in range(5)]
+            return ("releases", 200, releases, {})
+        return ("unknown", 404, {"message": "404 Not Found"}, {})
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes, without this delayed ACKs add ~40ms per request
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                self.answer(fake.route(parsed.path, parse_qs(parsed.query)))
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if urlparse(self.path).path.endswith("/api/graphql"):
+                    self.answer(fake.graphql(request))
+                else:
+                    self.answer(("unknown", 404, {"message": "404 Not Found"}, {}))
+
+            def answer(self, routed):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                (endpoint, status, body, headers) = routed
+                payload = json.dumps(body).encode()
+                if endpoint == "config":
+                    # Raw file downloads carry an ETag, an unchanged file answers If-None-Match with a 304
+                    headers = dict(headers, ETag='"{}"'.format(hashlib.sha1(payload).hexdigest()[:16]))
+                    if self.headers.get("If-None-Match") == headers['ETag']:
+                        (endpoint, status, payload) = ("config_not_modified", 304, b"")
+                with fake._lock:
+                    fake.calls[endpoint] += 1
+                    fake.bytes_sent += len(payload)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if status != 304:
+                    self.send_header("Content-Length", str(len(payload)))
+                for (name, value) in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve(self, port=0):
+        """Start serving in a background thread
+
+        Returns:
+            ThreadingHTTPServer: The running server, base_url is set on the fake
+        """
+        server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        server.daemon_threads = True
+        self.base_url = "http://127.0.0.1:{}/api/v4/".format(server.server_address[1])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--issues", type=int, default=5000, help="issues in the group")
+    parser.add_argument("--labels", type=int, default=40, help="extra label cardinality")
+    parser.add_argument("--teams", type=int, default=2, help="teams in the config")
+    parser.add_argument("--users", type=int, default=60, help="distinct users")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--configs", type=int, default=1, help="configs served, each with its own group label")
+    parser.add_argument("--history", type=int, default=0, help="iteration_history in the configs served")
+    parser.add_argument("--projects", type=int, default=0, help="projects in the group, turns on vuln and pipeline status")
+    parser.add_argument("--port", type=int, default=8080)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    fake = FakeGitLab(args.issues, args.labels, args.teams, args.users, args.latency, configs=args.configs, history=args.history, projects=args.projects)
+    server = fake.serve(args.port)
+    print("Fake GitLab on {}".format(fake.base_url))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
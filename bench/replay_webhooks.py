@@ -0,0 +1,160 @@
+"""Replay recorded GitLab webhook payloads.
+
+    python bench/replay_webhooks.py --url http://localhost:8080/webhooks/gitlab --token secret
+    python bench/replay_webhooks.py --offline
+
+--offline starts the local fake GitLab, runs one refresh, feeds every payload to the webhook handler and
+prints the series each one changed.  The payloads in bench/webhooks are shaped like the issue hooks GitLab
+sends and point at issues the fake serves with its default arguments.  Each payload's status and series
+changes are checked against bench/webhooks_expected.json, and the iteration series against working them out
+again from the issue store.  Exits non zero when any differ, --url only checks the status.
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+import logging
+import urllib.request
+import urllib.error
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "app"))
+
+PAYLOAD_DIR = os.path.join(BENCH_DIR, "webhooks")
+EXPECTED_FILE = os.path.join(BENCH_DIR, "webhooks_expected.json")
+
+
+def load_payloads(directory):
+    payloads = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path) as f:
+            payloads.append((os.path.basename(path), json.load(f)))
+    return payloads
+
+
+def load_expected(path):
+    """Payload name -> {"status": ..., "changes": {series: change}}, see series_name"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def series_name(key):
+    (metric, labels) = key
+    return "{}{{{}}}".format(metric, ",".join(labels))
+
+
+def event_header(payload):
+    kind = payload.get('object_kind', "unknown")
+    return "{} Hook".format(kind.replace("_", " ").title())
+
+
+def replay_http(url, token, payloads, expected):
+    failed = 0
+    for (name, payload) in payloads:
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json", "X-Gitlab-Token": token, "X-Gitlab-Event": event_header(payload)},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                body = response.read().decode()
+                print("{}: {} {}".format(name, response.status, body))
+                status = json.loads(body).get('status')
+        except urllib.error.HTTPError as e:
+            print("{}: {} {}".format(name, e.code, e.read().decode()))
+            status = None
+        if name in expected and status != expected[name]['status']:
+            print("    expected {}".format(expected[name]['status']))
+            failed += 1
+    return failed
+
+
+def applied_series(collector):
+    """Every applied series as (metric name, labels) -> value"""
+    with collector.snapshot_lock:
+        return {(metric._name, labels): value for (metric, series) in collector.APPLIED.values.items() for (labels, value) in series.items()}
+
+
+def recompute_differences(main, collector):
+    """Current iteration series that differ from working them out again from the issue store.  A series a
+    webhook took down to 0 is reported as 0 until the next refresh, so it counts as missing."""
+    applied = applied_series(collector)
+    issue_gauges = {gauge._name for gauge in main.ISSUE_GAUGES}
+    differences = []
+    for config in main.CONFIG_MAPS:
+        snapshot = collector.MetricSnapshot()
+        main.issue_metrics_from_store(config, snapshot)
+        full = {(gauge._name, labels): value for (gauge, series) in snapshot.gauges.items() for (labels, value) in series.items()}
+        iteration = (main.group_name(config), main.ISSUE_STORE[(config['parent_group'], config['team_label'], False)]['iteration'])
+        current = {key: value for (key, value) in applied.items() if key[0] in issue_gauges and key[1][:2] == iteration}
+        differences += [key for key in set(current) | set(full) if current.get(key, 0) != full.get(key, 0) or (key in full and key not in current)]
+    return differences
+
+
+def replay_offline(payloads, expected):
+    from fake_gitlab import FakeGitLab
+
+    fake = FakeGitLab()
+    server = fake.serve()
+    os.environ["GITLAB_URL"] = fake.base_url
+    os.environ.setdefault("CONFIG_PROJECT_ID", "1")
+    os.environ.setdefault("CONFIG_FILENAME", "config.json")
+    os.environ.setdefault("CONFIG_BRANCH", "main")
+    os.environ.setdefault("GL_ACCESS_TOKEN", "replay")
+
+    import main
+    import collector
+
+    collector.refresh_once(main.build_metrics, main.SNAPSHOT_GAUGES, main.SNAPSHOT_INFOS)
+    failed = 0
+    for (name, payload) in payloads:
+        before = applied_series(collector)
+        calls = sum(fake.calls.values())
+        status = main.handle_issue_webhook(payload)
+        after = applied_series(collector)
+        print("{}: {}, {} GitLab calls".format(name, status, sum(fake.calls.values()) - calls))
+        changes = {}
+        for key in sorted(set(before) | set(after), key=str):
+            if before.get(key) != after.get(key):
+                print("    {}{} {} -> {}".format(key[0], list(key[1]), before.get(key), after.get(key)))
+                changes[series_name(key)] = after.get(key, 0) - before.get(key, 0)
+        if name in expected:
+            if status != expected[name]['status']:
+                print("    expected {}".format(expected[name]['status']))
+                failed += 1
+            wanted = expected[name]['changes']
+            for series in sorted(set(wanted) | set(changes)):
+                if wanted.get(series) != changes.get(series):
+                    print("    {} changed by {}, expected {}".format(series, changes.get(series), wanted.get(series)))
+                    failed += 1
+        for key in recompute_differences(main, collector):
+            print("    {} does not match the issue store".format(series_name(key)))
+            failed += 1
+    server.shutdown()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="webhook endpoint of a running exporter")
+    parser.add_argument("--token", default=os.environ.get("WEBHOOK_SECRET", ""), help="X-Gitlab-Token to send, defaults to WEBHOOK_SECRET")
+    parser.add_argument("--offline", action="store_true", help="replay against the fake GitLab in this process")
+    parser.add_argument("--payloads", default=PAYLOAD_DIR, help="directory of recorded payloads")
+    parser.add_argument("--expected", default=EXPECTED_FILE, help="expected status and series changes by payload, empty to skip")
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.payloads)
+    expected = load_expected(args.expected) if args.expected else {}
+    if args.offline:
+        logging.disable(logging.INFO)
+        failed = replay_offline(payloads, expected)
+    elif args.url:
+        failed = replay_http(args.url, args.token, payloads, expected)
+    else:
+        parser.error("pass --url or --offline")
+    print("{} payloads, {} mismatches".format(len(payloads), failed))
+    sys.exit(1 if failed else 0)